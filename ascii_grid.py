@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import os
+import json
+import hashlib
+import numpy as np
+from scipy.interpolate import NearestNDInterpolator
+
+def read_header(path_to_ascii_grid_file):
+    "read metadata from esri ascii grid file"
+    metadata = {}
+    header_str = ""
+    with open(path_to_ascii_grid_file) as _:
+        for i in range(0, 6):
+            line = _.readline()
+            header_str += line
+            sline = [x for x in line.split() if len(x) > 0]
+            if len(sline) > 1:
+                metadata[sline[0].strip().lower()] = float(sline[1].strip())
+    return metadata, header_str
+
+def source_key(path_to_ascii_grid_file):
+    "the key identifying the current version of a grid file: absolute path, size and mtime"
+    stat = os.stat(path_to_ascii_grid_file)
+    return {
+        "path": os.path.abspath(path_to_ascii_grid_file),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime
+    }
+
+def cache_paths(path_to_ascii_grid_file, path_to_cache_dir):
+    "paths to the .npy data file and the .json sidecar caching the given grid file"
+    abs_path = os.path.abspath(path_to_ascii_grid_file)
+    name = os.path.splitext(os.path.basename(abs_path))[0] + "_" + hashlib.sha1(abs_path.encode("utf-8")).hexdigest()[:10]
+    path = os.path.join(path_to_cache_dir, name)
+    return path + ".npy", path + ".json"
+
+def read_sidecar(path_to_ascii_grid_file, path_to_cache_dir):
+    "return the cache sidecar of the grid file if it is still valid, else None"
+    _, path_to_sidecar = cache_paths(path_to_ascii_grid_file, path_to_cache_dir)
+    try:
+        with open(path_to_sidecar) as _:
+            sidecar = json.load(_)
+    except (IOError, OSError, ValueError):
+        return None
+    if sidecar.get("source") != source_key(path_to_ascii_grid_file):
+        return None
+    return sidecar
+
+def write_cache(path_to_ascii_grid_file, path_to_cache_dir, grid, metadata, header_str):
+    "store grid as .npy file and header as .json sidecar, the sidecar is written last and marks the entry as complete"
+    if not os.path.isdir(path_to_cache_dir):
+        os.makedirs(path_to_cache_dir)
+    path_to_npy, path_to_sidecar = cache_paths(path_to_ascii_grid_file, path_to_cache_dir)
+    tmp_npy = path_to_npy + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_npy, "wb") as _:
+        np.save(_, grid)
+    os.rename(tmp_npy, path_to_npy)
+    tmp_sidecar = path_to_sidecar + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_sidecar, "w") as _:
+        json.dump({
+            "source": source_key(path_to_ascii_grid_file),
+            "metadata": metadata,
+            "header": header_str,
+            "dtype": grid.dtype.str,
+            "shape": list(grid.shape)
+        }, _)
+    os.rename(tmp_sidecar, path_to_sidecar)
+
+def read_grid(path_to_ascii_grid_file, dtype=int, skiprows=6, path_to_cache_dir=None):
+    """
+    read esri ascii grid file and return (grid, metadata, header_str),
+    if path_to_cache_dir is given the parsed grid is served memory-mapped from a binary cache,
+    which is rebuilt whenever path, size or mtime of the source file change
+    """
+    if path_to_cache_dir:
+        sidecar = read_sidecar(path_to_ascii_grid_file, path_to_cache_dir)
+        if sidecar and sidecar["dtype"] == np.dtype(dtype).str:
+            path_to_npy, _ = cache_paths(path_to_ascii_grid_file, path_to_cache_dir)
+            try:
+                grid = np.load(path_to_npy, mmap_mode="r")
+                if list(grid.shape) == sidecar["shape"]:
+                    return grid, sidecar["metadata"], sidecar["header"]
+            except (IOError, OSError, ValueError):
+                pass
+
+    metadata, header_str = read_header(path_to_ascii_grid_file)
+    grid = np.loadtxt(path_to_ascii_grid_file, dtype=dtype, skiprows=skiprows)
+    if path_to_cache_dir:
+        write_cache(path_to_ascii_grid_file, path_to_cache_dir, grid, metadata, header_str)
+    return grid, metadata, header_str
+
+def window_metadata(metadata, start_row, end_row):
+    "header of the rows [start_row, end_row) of a grid as grid of its own"
+    window = dict(metadata)
+    window["nrows"] = float(end_row - start_row)
+    window["yllcorner"] = metadata["yllcorner"] + (int(metadata["nrows"]) - end_row) * metadata["cellsize"]
+    return window
+
+class GridWindows(object):
+    """
+    windows of rows of an esri ascii grid, read front to back without holding the whole grid,
+    consecutive windows may overlap (halo), one starting before the previous one reads the file again from its start,
+    a valid binary cache (see read_grid) is used memory-mapped instead
+    """
+
+    def __init__(self, path_to_ascii_grid_file, dtype=int, skiprows=6, path_to_cache_dir=None):
+        self.path_to_ascii_grid_file = path_to_ascii_grid_file
+        self.dtype = dtype
+        self.skiprows = skiprows
+        self.metadata, self.header_str = read_header(path_to_ascii_grid_file)
+        self.nrows = int(self.metadata["nrows"])
+        self.ncols = int(self.metadata["ncols"])
+        self.grid = None
+        if path_to_cache_dir:
+            sidecar = read_sidecar(path_to_ascii_grid_file, path_to_cache_dir)
+            if sidecar and sidecar["dtype"] == np.dtype(dtype).str:
+                try:
+                    grid = np.load(cache_paths(path_to_ascii_grid_file, path_to_cache_dir)[0], mmap_mode="r")
+                    if list(grid.shape) == sidecar["shape"]:
+                        self.grid = grid
+                except (IOError, OSError, ValueError):
+                    pass
+        self.file = None
+        if self.grid is None:
+            self.file = open(path_to_ascii_grid_file)
+        self._rewind()
+
+    def _rewind(self):
+        "continue reading at the first row"
+        if self.file:
+            self.file.seek(0)
+            for _ in range(self.skiprows):
+                self.file.readline()
+        # the rows read but still needed start at first_row
+        self.first_row = 0
+        self.rows = np.empty((0, self.ncols), dtype=self.dtype)
+
+    def _read(self, no_of_rows):
+        lines = [self.file.readline() for _ in range(no_of_rows)]
+        return np.fromstring(" ".join(lines), dtype=self.dtype, sep=" ").reshape(no_of_rows, self.ncols)
+
+    def window(self, start_row, end_row):
+        "the rows [start_row, end_row) clipped to the grid"
+        start_row = max(0, start_row)
+        end_row = max(start_row, min(self.nrows, end_row))
+        if self.grid is not None:
+            return self.grid[start_row:end_row]
+        if start_row < self.first_row:
+            self._rewind()
+        read_until = self.first_row + len(self.rows)
+        if start_row >= read_until:
+            # skip the rows nobody asked for
+            for _ in range(start_row - read_until):
+                self.file.readline()
+            self.rows = self.rows[:0]
+            read_until = start_row
+        else:
+            self.rows = self.rows[start_row - self.first_row:]
+        self.first_row = start_row
+        if end_row > read_until:
+            self.rows = np.concatenate([self.rows, self._read(end_row - read_until)])
+        return self.rows[:end_row - start_row]
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def create_ascii_grid_interpolator(arr, meta, ignore_nodata=True):
+    "create interpolator from numpy array"
+
+    rows, cols = arr.shape
+
+    cellsize = int(meta["cellsize"])
+    xll = int(meta["xllcorner"])
+    yll = int(meta["yllcorner"])
+    nodata_value = meta["nodata_value"]
+
+    xll_center = xll + cellsize // 2
+    yll_center = yll + cellsize // 2
+    yul_center = yll_center + (rows - 1)*cellsize
+
+    if ignore_nodata:
+        data_rows, data_cols = np.nonzero(arr != nodata_value)
+    else:
+        data_rows, data_cols = np.indices((rows, cols)).reshape(2, -1)
+    data_rows = data_rows.astype(np.int32)
+    data_cols = data_cols.astype(np.int32)
+
+    points = np.empty((len(data_rows), 2), dtype=np.int32)
+    points[:, 0] = xll_center + data_cols * np.int32(cellsize)
+    points[:, 1] = yul_center - data_rows * np.int32(cellsize)
+    values = np.asarray(arr[data_rows, data_cols], dtype=arr.dtype)
+
+    return NearestNDInterpolator(points, values)
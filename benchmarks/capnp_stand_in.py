@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+local stand-in for the RunYieldstat capnp service, answers every env after a fixed latency
+without blocking the event loop, so pipelined requests overlap like on the real service
+
+    python capnp_stand_in.py address=localhost:6666 latency_ms=50
+    python producer_capnp.py server=localhost:6666 capnp_schema=benchmarks/run_yieldstat_stand_in.capnp window=16
+"""
+
+import os
+import sys
+import json
+
+import capnp
+
+def create_result(env):
+    "a result shaped like the workers' with values derived from the env"
+    year2crop_result = {}
+    for year in range(env["startYear"], env["endYear"] + 1):
+        year2crop_result[str(year)] = {
+            "isNoData": False,
+            "values": {"yield": env["stt"] * 10.5 + env["hft"] + year % 7, "wn": env["dgm"] * 0.25}
+        }
+    return {"type": "result", "customId": env["customId"], "runFailed": False, "year2cropResult": year2crop_result}
+
+def main():
+    "serve RunYieldstat on address"
+
+    config = {
+        "address": "localhost:6666",
+        "latency_ms": "50",
+        "capnp_schema": os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_yieldstat_stand_in.capnp")
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    schema = capnp.load(config["capnp_schema"])
+    latency_ns = int(float(config["latency_ms"]) * 1000000)
+
+    class RunYieldstatImpl(schema.RunYieldstat.Server):
+
+        def run_context(self, context):
+            result_str = json.dumps(create_result(json.loads(context.params.envString)))
+            def respond():
+                context.results.resultString = result_str
+            return capnp.getTimer().after_delay(latency_ns).then(respond)
+
+    server = capnp.TwoPartyServer(config["address"], bootstrap=RunYieldstatImpl())
+    print "serving RunYieldstat on", config["address"], "with", config["latency_ms"], "ms latency"
+    server.run_forever()
+
+if __name__ == "__main__":
+    main()
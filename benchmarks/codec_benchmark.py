@@ -0,0 +1,127 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import codec
+
+def create_env(row, col):
+    "env as sent by producer.py"
+    return {
+        "type": "Yieldstat::Core::Env",
+        "climateScenario": "A1B",
+        "startYear": 1991,
+        "endYear": 2012,
+        "trendBaseYear": 2005,
+        "useDevTrend": False,
+        "useCO2Increase": True,
+        "returnCornUnits": False,
+        "getDryYearWaterNeed": False,
+        "cropRotation": [
+            {"type": "Yieldstat::Core::YSCrop", "id": 1017, "tillageType": "plough", "irrigate": True},
+            {"type": "Yieldstat::Core::YSCrop", "id": 1013, "tillageType": "noTillage", "irrigate": False}
+        ],
+        "dgm": random.randint(0, 200), "hft": random.randint(1, 9), "nft": random.randint(1, 9),
+        "sft": random.randint(1, 9), "slope": random.randint(0, 5), "steino": random.randint(1, 9),
+        "az": random.randint(1, 9), "klz": random.randint(1, 9), "stt": random.randint(100, 200),
+        "csvViaHeaderOptions": {"start-date": "1991-01-01", "end-date": "2012-12-31", "no-of-climate-file-header-lines": 2, "csv-separator": ","},
+        "pathToClimateCSV": "/data/archiv-daten/md/data/climate/dwd/csvs/germany/row-123/col-456.csv",
+        "customId": {"row": row, "col": col, "crow": 122, "ccol": 455}
+    }
+
+def create_result(row, col, res_ids):
+    "result as returned by the workers"
+    return {
+        "type": "result",
+        "customId": {"row": row, "col": col, "crow": 122, "ccol": 455},
+        "runFailed": False,
+        "year2cropResult": dict([(str(year), {
+            "isNoData": False,
+            "values": dict([(res_id, round(random.uniform(0, 100), 2)) for res_id in res_ids])
+        }) for year in range(1991, 2013)])
+    }
+
+def measure(msgs, wire_format, compression, repetitions=3):
+    "best of the repetitions: (encode seconds, decode seconds, bytes) for all messages"
+    best = None
+    for _ in range(repetitions):
+        start = time.time()
+        encoded = [codec.encode(msg, wire_format, compression) for msg in msgs]
+        encode_time = time.time() - start
+        start = time.time()
+        for data in encoded:
+            codec.decode(data)
+        decode_time = time.time() - start
+        size = sum(len(data) for data in encoded)
+        if best is None or encode_time + decode_time < best[0] + best[1]:
+            best = (encode_time, decode_time, size)
+    return best
+
+def main():
+    "compare encode/decode cost and bytes on the wire per cell for all codec combinations"
+
+    config = {
+        "cells": "2000",
+        "res_ids": "yield,wn,et,gw,nleach,som",
+        "batch_size": "1"
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    random.seed(0)
+    no_of_cells = int(config["cells"])
+    batch_size = int(config["batch_size"])
+    res_ids = config["res_ids"].split(",")
+
+    def batched(msgs):
+        if batch_size <= 1:
+            return msgs
+        return [msgs[i:i + batch_size] for i in range(0, len(msgs), batch_size)]
+
+    msg_sets = [
+        ("envs", batched([create_env(i // 100, i % 100) for i in range(no_of_cells)])),
+        ("results", batched([create_result(i // 100, i % 100, res_ids) for i in range(no_of_cells)]))
+    ]
+
+    combinations = [("json", "")]
+    combinations.append(("json", "zlib"))
+    if codec.lz4:
+        combinations.append(("json", "lz4"))
+    if codec.msgpack:
+        combinations.append(("msgpack", ""))
+        combinations.append(("msgpack", "zlib"))
+        if codec.lz4:
+            combinations.append(("msgpack", "lz4"))
+
+    print "cells:", no_of_cells, "batch_size:", batch_size, "res_ids:", len(res_ids)
+    print "%-8s %-8s %-5s %14s %14s %14s" % ("msgs", "format", "comp", "encode us/cell", "decode us/cell", "bytes/cell")
+    for name, msgs in msg_sets:
+        for wire_format, compression in combinations:
+            encode_time, decode_time, size = measure(msgs, wire_format, compression)
+            print "%-8s %-8s %-5s %14.1f %14.1f %14.1f" % (
+                name, wire_format, compression or "-",
+                encode_time * 1e6 / no_of_cells, decode_time * 1e6 / no_of_cells, float(size) / no_of_cells)
+
+if __name__ == "__main__":
+    main()
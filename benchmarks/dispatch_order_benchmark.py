@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+the producer's dispatch orders (order=rows|climate|hilbert) on the e2e benchmark with a fake worker
+whose threads keep only a few climate files parsed and take climate_load_ms to read another one
+
+    python benchmarks/dispatch_order_benchmark.py climate_load_ms=5 climate_cache=1 worker_threads=4
+"""
+
+import sys
+import shutil
+import tempfile
+
+import e2e_benchmark
+
+def main():
+    "run the e2e benchmark once per order on the same region and compare"
+
+    config = e2e_benchmark.default_config()
+    config.update({
+        "orders": "rows,climate,hilbert",
+        "latency_ms": "0.2",
+        "climate_load_ms": "5",
+        "climate_cache": "1"
+    })
+    producer_args = []
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=", 1)
+            if k.startswith("producer."):
+                producer_args.append(k[len("producer."):] + "=" + v)
+            elif k in config:
+                config[k] = v
+
+    # all orders on the same region
+    path_to_data_dir = None
+    if not config["data_dir"]:
+        path_to_data_dir = tempfile.mkdtemp(prefix="yieldstat_dispatch_order_")
+        config["data_dir"] = path_to_data_dir
+
+    print "%-8s %10s %10s %12s %12s %14s %14s" % ("order", "seconds", "results/s", "climate hits", "misses", "latency p50 ms", "latency p95 ms")
+    for order in config["orders"].split(","):
+        stats = e2e_benchmark.run_benchmark(config, producer_args + ["order=" + order], [])
+        latency_ms = stats["latency_ms"] or {}
+        print "%-8s %10s %10s %12s %12s %14s %14s" % (
+            order, stats["seconds"], stats["results_per_s"], stats["climate_hits"], stats["climate_misses"],
+            latency_ms.get("p50"), latency_ms.get("p95"))
+        if not stats["ok"]:
+            print "run with order", order, "failed, see the logs (keep=true)"
+
+    if path_to_data_dir:
+        shutil.rmtree(path_to_data_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
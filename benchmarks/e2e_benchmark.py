@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+producer -> fake worker -> consumer on a synthetic region, without the cluster and the real data
+
+generates the region (benchmarks/synthetic_region.py) unless data_dir already holds it, starts
+benchmarks/fake_worker.py, run_consumer and run_producer as processes and reports envs/s of the
+producer, results/s end to end, the latency and the peak rss of producer and consumer
+(from their metrics files and profile reports)
+
+    python benchmarks/e2e_benchmark.py nrows=400 ncols=600 latency_ms=5 worker_threads=16
+    python benchmarks/e2e_benchmark.py producer.batch_size=20 producer.wire_format=msgpack
+
+producer.<key>=<value> and consumer.<key>=<value> are passed on to run_producer and run_consumer
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+import synthetic_region
+
+PATH_TO_REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def read_json(path_to_file):
+    if not os.path.exists(path_to_file):
+        return {}
+    with open(path_to_file) as _:
+        return json.load(_)
+
+def read_producer_metrics(path_to_work_dir):
+    """
+    the producer's metrics summed over its export files, sharded runs write one per shard (and sweep scenario),
+    the rates are over the longest elapsed time of the shards, added up over the scenarios sent one after the other
+    """
+    counters = {}
+    scenario_seconds = {}
+    for path in glob.glob(path_to_work_dir + "producer_metrics*.json"):
+        snapshot = read_json(path)
+        for counter, value in snapshot.get("counters", {}).iteritems():
+            counters[counter] = counters.get(counter, 0) + value
+        scenario = re.match(r"producer_metrics(?:_shard\d+)?(.*)\.json$", os.path.basename(path)).group(1)
+        scenario_seconds[scenario] = max(scenario_seconds.get(scenario, 0), snapshot.get("elapsed_s", 0))
+    elapsed = sum(scenario_seconds.values())
+    if not elapsed:
+        return {}
+    return {
+        "counters": counters, "elapsed_s": round(elapsed, 3),
+        "rates_per_s": dict((counter, round(value / elapsed, 1)) for counter, value in counters.iteritems())
+    }
+
+def start(script, args, path_to_log_file):
+    "start a python script of the repo as process logging to path_to_log_file"
+    log = open(path_to_log_file, "w")
+    return subprocess.Popen([sys.executable, script] + args, cwd=PATH_TO_REPO, stdout=log, stderr=subprocess.STDOUT)
+
+def wait(process, timeout):
+    "wait for the process up to timeout seconds, kill it then, returns true if it exited by itself"
+    end_time = time.time() + timeout
+    while process.poll() is None:
+        if time.time() > end_time:
+            process.kill()
+            process.wait()
+            return False
+        time.sleep(0.05)
+    return True
+
+def run_benchmark(config, producer_args, consumer_args):
+    "one producer/worker/consumer run, returns the stats"
+    path_to_work_dir = config["work_dir"] or tempfile.mkdtemp(prefix="yieldstat_e2e_")
+    path_to_work_dir = os.path.join(os.path.abspath(path_to_work_dir), "")
+    path_to_data_dir = os.path.join(os.path.abspath(config["data_dir"]), "") if config["data_dir"] else path_to_work_dir + "data/"
+    path_to_out_dir = path_to_work_dir + "out/"
+    for path in [path_to_work_dir, path_to_out_dir]:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    if not os.path.exists(path_to_data_dir + config["region"] + "/stt_" + config["region"] + "_100_gk5.asc"):
+        no_of_datacells = synthetic_region.create_region(path_to_data_dir, config["region"], int(config["nrows"]), int(config["ncols"]),
+                                                         float(config["datacell_share"]), seed=int(config["seed"]))
+        print "wrote region", config["region"], "with", no_of_datacells, "datacells to", path_to_data_dir
+
+    common_args = ["region=" + config["region"], "ref_mmk_type=stt", "data_dir=" + path_to_data_dir, "cache_dir=" + path_to_work_dir + "cache/"]
+    if not os.path.isdir(path_to_work_dir + "cache/"):
+        os.makedirs(path_to_work_dir + "cache/")
+    consumer_args = common_args + [
+        "out=" + path_to_out_dir, "metrics_file=" + path_to_work_dir + "consumer_metrics.json",
+        "profile=true", "profile_report=" + path_to_work_dir + "consumer_profile.json"] + consumer_args
+    producer_args = common_args + [
+        "server=localhost", "metrics_file=" + path_to_work_dir + "producer_metrics.json",
+        "profile=true", "profile_report=" + path_to_work_dir + "producer_profile.json"] + producer_args
+
+    worker = start("benchmarks/fake_worker.py", [
+        "latency_ms=" + config["latency_ms"], "threads=" + config["worker_threads"], "climate_load_ms=" + config["climate_load_ms"],
+        "climate_cache=" + config["climate_cache"], "stats_file=" + path_to_work_dir + "worker_stats.json"], path_to_work_dir + "worker.log")
+    time.sleep(0.5)
+    consumer = start("consumer.py", consumer_args, path_to_work_dir + "consumer.log")
+    time.sleep(0.5)
+
+    start_time = time.time()
+    producer = start("producer.py", producer_args, path_to_work_dir + "producer.log")
+    timeout = float(config["timeout"])
+    producer_ok = wait(producer, timeout)
+    consumer_ok = wait(consumer, max(1.0, timeout - (time.time() - start_time)))
+    seconds = time.time() - start_time
+    # the worker writes its stats every second
+    time.sleep(1.2)
+    worker.kill()
+    worker.wait()
+
+    producer_metrics = read_producer_metrics(path_to_work_dir)
+    consumer_metrics = read_json(path_to_work_dir + "consumer_metrics.json")
+    producer_profile = read_json(path_to_work_dir + "producer_profile.json")
+    consumer_profile = read_json(path_to_work_dir + "consumer_profile.json")
+    worker_stats = read_json(path_to_work_dir + "worker_stats.json")
+
+    envs = producer_metrics.get("counters", {}).get("envs", 0)
+    results = consumer_metrics.get("counters", {}).get("results", 0)
+    stats = OrderedDict([
+        ("ok", producer_ok and consumer_ok and producer.returncode == 0 and consumer.returncode == 0),
+        ("datacells", consumer_metrics.get("total")),
+        ("seconds", round(seconds, 3)),
+        ("envs", envs),
+        ("producer_send_seconds", producer_metrics.get("elapsed_s")),
+        ("envs_per_s", producer_metrics.get("rates_per_s", {}).get("envs")),
+        ("results", results),
+        ("cells", consumer_metrics.get("counters", {}).get("cells", 0)),
+        ("results_per_s", round(results / seconds, 1) if seconds > 0 else None),
+        ("latency_ms", consumer_metrics.get("latency_ms")),
+        ("climate_hits", worker_stats.get("climate_hits")),
+        ("climate_misses", worker_stats.get("climate_misses")),
+        ("producer_seconds", producer_profile.get("total_seconds")),
+        ("producer_peak_rss_mb", producer_profile.get("peak_rss_mb")),
+        ("consumer_peak_rss_mb", consumer_profile.get("peak_rss_mb")),
+        ("work_dir", path_to_work_dir)
+    ])
+
+    if not config["work_dir"] and not config["keep"] == "true":
+        shutil.rmtree(path_to_work_dir, ignore_errors=True)
+        stats["work_dir"] = None
+    return stats
+
+def default_config():
+    "the benchmark's config, the values are strings as on the command line"
+    return {
+        "work_dir": "", # data, output, logs, metrics and profiles, empty = a temporary dir which is removed afterwards
+        "keep": "false", # true = keep the temporary work dir
+        "data_dir": "", # existing or to be generated region, empty = data/ in work_dir
+        "region": "bench",
+        "nrows": "200",
+        "ncols": "300",
+        "datacell_share": "0.6",
+        "seed": "0",
+        "latency_ms": "0", # time the fake worker takes per env
+        "worker_threads": "4", # envs the fake worker works on concurrently
+        "climate_load_ms": "0", # time the fake worker takes to read a climate file it hasn't cached
+        "climate_cache": "1", # climate files each fake worker thread keeps cached
+        "timeout": "600", # seconds until producer and consumer are killed
+        "stats_file": "" # also write the stats as json there
+    }
+
+def main():
+    "run the benchmark and print the stats"
+
+    config = default_config()
+    producer_args = []
+    consumer_args = []
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=", 1)
+            if k.startswith("producer."):
+                producer_args.append(k[len("producer."):] + "=" + v)
+            elif k.startswith("consumer."):
+                consumer_args.append(k[len("consumer."):] + "=" + v)
+            elif k in config:
+                config[k] = v
+
+    stats = run_benchmark(config, producer_args, consumer_args)
+
+    print "%-24s %s" % ("producer args:", " ".join(producer_args) or "-")
+    print "%-24s %s" % ("consumer args:", " ".join(consumer_args) or "-")
+    for key, value in stats.iteritems():
+        print "%-24s %s" % (key + ":", json.dumps(value) if isinstance(value, dict) else value)
+    if config["stats_file"]:
+        with open(config["stats_file"], "w") as _:
+            json.dump(stats, _, indent=2)
+    if not stats["ok"]:
+        print "producer or consumer failed or timed out, see their logs (keep=true)"
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
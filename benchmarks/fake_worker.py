@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+stand-in for the yieldstat workers: pulls envs on env_port (where the producer connects)
+and pushes plausible results on result_port (where the consumer connects)
+
+every env takes latency_ms, threads envs are worked on concurrently. batches and all
+codec.py formats are supported, results go back in the format the envs came in,
+finish messages are passed on unchanged.
+like a worker process every thread keeps the last climate_cache climate files parsed,
+reading one which isn't among them takes climate_load_ms more
+
+    python benchmarks/fake_worker.py latency_ms=20 threads=8
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import codec
+
+def message_format(data):
+    "(wire format, compression) of an encoded message"
+    if not data.startswith(codec.MAGIC):
+        return "json", ""
+    wire_format = [name for name, byte in codec.FORMATS.iteritems() if byte == data[2:3]][0]
+    compression = [name for name, byte in codec.COMPRESSIONS.iteritems() if byte == data[3:4]][0]
+    return wire_format, compression
+
+def create_result(env, res_ids):
+    "result for env, the values depend on the soil, the climate cell and the year only"
+    custom_id = env["customId"]
+    base = 30 + 4 * env["az"] + 2 * env["klz"] - env["slope"] + (env["stt"] % 7) + 0.01 * env["dgm"]
+    base += (custom_id.get("crow", 0) * 3 + custom_id.get("ccol", 0)) % 5
+    year2crop_result = {}
+    for year in range(env["startYear"], env["endYear"] + 1):
+        value = base + (year * 37 % 11) - 5
+        year2crop_result[str(year)] = {
+            "isNoData": False,
+            "values": dict([(res_id, round(value * (no + 1) * 0.5, 2)) for no, res_id in enumerate(res_ids)])
+        }
+    return {"type": "result", "customId": custom_id, "runFailed": False, "year2cropResult": year2crop_result}
+
+class ClimateCache(object):
+    "the climate files a worker keeps parsed, least recently used ones are dropped"
+
+    def __init__(self, size, load_time, stats):
+        self.size = size
+        self.load_time = load_time
+        self.stats = stats
+        self.files = OrderedDict()
+
+    def read(self, path):
+        "pretend to read the climate file, takes load_time unless it is cached"
+        hit = path in self.files
+        if hit:
+            del self.files[path]
+        elif self.load_time > 0:
+            time.sleep(self.load_time)
+        if self.size > 0:
+            self.files[path] = True
+            if len(self.files) > self.size:
+                self.files.popitem(last=False)
+        self.stats.count("climate_hits" if hit else "climate_misses")
+
+class Stats(object):
+    "counters of all threads, optionally written to a json file every second"
+
+    def __init__(self, path_to_file=None):
+        self.path_to_file = path_to_file
+        self.lock = threading.Lock()
+        self.counters = OrderedDict([("envs", 0), ("climate_hits", 0), ("climate_misses", 0)])
+
+    def count(self, counter, count=1):
+        with self.lock:
+            self.counters[counter] += count
+
+    def write_every_second(self):
+        last = None
+        while True:
+            with self.lock:
+                counters = OrderedDict(self.counters)
+            if counters != last:
+                tmp_path = self.path_to_file + ".tmp"
+                with open(tmp_path, "w") as _:
+                    json.dump(counters, _)
+                os.rename(tmp_path, self.path_to_file)
+                last = counters
+            time.sleep(1)
+
+def work(context, latency, res_ids, climate_cache, stats):
+    "worker thread: answer the envs of the inproc queue"
+    envs = context.socket(zmq.PULL)
+    envs.setsockopt(zmq.RCVHWM, 1)
+    envs.connect("inproc://envs")
+    results = context.socket(zmq.PUSH)
+    results.connect("inproc://results")
+    while True:
+        data = envs.recv()
+        wire_format, compression = message_format(data)
+        msg = codec.decode(data)
+        if isinstance(msg, dict) and msg.get("type") == "finish":
+            # like the workers, pass finish messages on to the consumer
+            results.send(data)
+            continue
+        batch = msg if isinstance(msg, list) else [msg]
+        for env in batch:
+            climate_cache.read(env.get("pathToClimateCSV"))
+        if latency > 0:
+            time.sleep(latency * len(batch))
+        stats.count("envs", len(batch))
+        out = [create_result(env, res_ids) for env in batch]
+        results.send(codec.encode(out if isinstance(msg, list) else out[0], wire_format, compression))
+
+def run_worker(config):
+    "bind the sockets and run the worker threads, doesn't return"
+    context = zmq.Context()
+
+    frontend = context.socket(zmq.PULL)
+    frontend.bind("tcp://*:" + config["env_port"])
+    to_threads = context.socket(zmq.PUSH)
+    to_threads.setsockopt(zmq.SNDHWM, 1)
+    to_threads.bind("inproc://envs")
+    from_threads = context.socket(zmq.PULL)
+    from_threads.bind("inproc://results")
+    backend = context.socket(zmq.PUSH)
+    backend.bind("tcp://*:" + config["result_port"])
+
+    latency = float(config["latency_ms"]) / 1000.0
+    res_ids = config["res_ids"].split(",")
+    stats = Stats(config["stats_file"] or None)
+    for _ in range(max(1, int(config["threads"]))):
+        climate_cache = ClimateCache(int(config["climate_cache"]), float(config["climate_load_ms"]) / 1000.0, stats)
+        thread = threading.Thread(target=work, args=(context, latency, res_ids, climate_cache, stats))
+        thread.daemon = True
+        thread.start()
+    if stats.path_to_file:
+        thread = threading.Thread(target=stats.write_every_second)
+        thread.daemon = True
+        thread.start()
+
+    results = threading.Thread(target=zmq.proxy, args=(from_threads, backend))
+    results.daemon = True
+    results.start()
+    print "fake worker: envs on", config["env_port"], "results on", config["result_port"], "latency ms:", config["latency_ms"], "threads:", config["threads"]
+    sys.stdout.flush()
+    zmq.proxy(frontend, to_threads)
+
+def main():
+    "run the fake worker"
+
+    config = {
+        "env_port": "6666",
+        "result_port": "7777",
+        "latency_ms": "0", # time one env takes
+        "threads": "4", # envs worked on concurrently
+        "res_ids": "yield,wn", # result ids returned for every year
+        "climate_load_ms": "0", # time reading a climate file takes if the thread doesn't have it parsed
+        "climate_cache": "1", # climate files a thread keeps parsed
+        "stats_file": "" # write the number of envs and climate cache hits and misses there every second (json)
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    run_worker(config)
+
+if __name__ == "__main__":
+    main()
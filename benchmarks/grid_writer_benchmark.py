@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import grid_writer
+
+def create_grids(no_of_grids, nrows, ncols, nodata_value):
+    "result like grids, about a third of the cells nodata"
+    rng = np.random.RandomState(0)
+    grids = []
+    for _ in range(no_of_grids):
+        grid = rng.uniform(0, 120, (nrows, ncols)).astype(np.float32)
+        grid[rng.rand(nrows, ncols) < 0.3] = nodata_value
+        grids.append(grid)
+    return grids
+
+def main():
+    "compare np.savetxt with grid_writer (single and multi threaded) for a consumer sized output"
+
+    config = {
+        "grids": "24",
+        "nrows": "1000",
+        "ncols": "800",
+        "threads": "4"
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    nrows = int(config["nrows"])
+    ncols = int(config["ncols"])
+    header = "ncols %d\nnrows %d\nxllcorner 5300000\nyllcorner 5770000\ncellsize 100\nNODATA_value -9999\n" % (ncols, nrows)
+    metadata = {"ncols": ncols, "nrows": nrows, "xllcorner": 5300000, "yllcorner": 5770000, "cellsize": 100, "nodata_value": -9999}
+    grids = create_grids(int(config["grids"]), nrows, ncols, -9999)
+    path_to_dir = tempfile.mkdtemp()
+
+    def savetxt():
+        for i, grid in enumerate(grids):
+            np.savetxt(os.path.join(path_to_dir, "savetxt_%d.asc" % i), grid, delimiter=" ", fmt="%.2f", header=header.strip(), comments="")
+
+    def writer(threads):
+        def write():
+            jobs = [(os.path.join(path_to_dir, "writer_%d" % i), grid) for i, grid in enumerate(grids)]
+            grid_writer.write_grids(jobs, header, metadata, threads=threads)
+        return write
+
+    try:
+        print "grids:", len(grids), "shape:", (nrows, ncols)
+        print "%-22s %10s %12s" % ("writer", "seconds", "Mcells/s")
+        cells = len(grids) * nrows * ncols
+        for name, write in [("np.savetxt", savetxt), ("grid_writer 1 thread", writer(1)),
+                            ("grid_writer %s threads" % config["threads"], writer(int(config["threads"])))]:
+            start = time.time()
+            write()
+            seconds = time.time() - start
+            print "%-22s %10.2f %12.2f" % (name, seconds, cells / seconds / 1e6)
+
+        identical = all(open(os.path.join(path_to_dir, "savetxt_%d.asc" % i), "rb").read() ==
+                        open(os.path.join(path_to_dir, "writer_%d.asc" % i), "rb").read() for i in range(len(grids)))
+        print "output identical:", identical
+    finally:
+        shutil.rmtree(path_to_dir)
+
+if __name__ == "__main__":
+    main()
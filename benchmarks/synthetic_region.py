@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+synthetic region for benchmarks, laid out like the data dir the producer reads
+
+<data_dir>/<region>/<mmk type>_<region>_100_gk5.asc  for all nine mmk types
+<data_dir>/climate/dwd/csvs/latlon_to_rowcol.json    regular lat/lon climate grid around the region
+
+    python benchmarks/synthetic_region.py data_dir=/tmp/bench/ nrows=500 ncols=800
+"""
+
+import os
+import sys
+import json
+
+import numpy as np
+from pyproj import transform
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import climate_locator
+
+NODATA_VALUE = -9999
+# somewhere in the uckermark, gk5
+XLLCORNER = 5430000
+YLLCORNER = 5880000
+CELLSIZE = 100
+
+# value range [low, high] and patch size in cells of the mmk types, soil maps consist of patches
+MMK_TYPES = [
+    ("hft", 1, 9, 12), ("nft", 1, 9, 12), ("sft", 1, 9, 12), ("steino", 1, 5, 16), ("slope", 1, 6, 4),
+    ("stt", 101, 124, 8), ("dgm", None, None, None), ("az", 1, 7, 20), ("klz", 1, 8, 20)
+]
+
+def patches(rng, nrows, ncols, low, high, patch_size):
+    "grid of random values in [low, high], constant over patch_size x patch_size blocks"
+    coarse = rng.randint(low, high + 1, size=(nrows // patch_size + 1, ncols // patch_size + 1))
+    return np.kron(coarse, np.ones((patch_size, patch_size), dtype=int))[:nrows, :ncols]
+
+def elevation(rng, nrows, ncols):
+    "smooth terrain between about 0 and 150 m"
+    rows, cols = np.mgrid[0:nrows, 0:ncols]
+    terrain = 60 + 40 * np.sin(rows / 37.0) * np.cos(cols / 53.0) + 30.0 * cols / max(ncols, 1)
+    return np.clip(terrain + rng.normal(0, 3, size=(nrows, ncols)), 0, 150).astype(int)
+
+def region_mask(rng, nrows, ncols, datacell_share):
+    "an ellipse with holes (lakes, towns) covering about datacell_share of the grid"
+    rows, cols = np.mgrid[0:nrows, 0:ncols]
+    distance = ((rows - nrows / 2.0) / (nrows / 2.0)) ** 2 + ((cols - ncols / 2.0) / (ncols / 2.0)) ** 2
+    # the ellipse covers pi/4 of the grid, holes take some of it again
+    radius = min(1.0, datacell_share / (np.pi / 4) * 1.1)
+    holes = patches(rng, nrows, ncols, 0, 9, 10) == 0
+    return (distance <= radius) & ~holes
+
+def write_grid(path_to_file, grid):
+    "write grid as esri ascii grid at the region's position"
+    header = "ncols %d\nnrows %d\nxllcorner %d\nyllcorner %d\ncellsize %d\nNODATA_value %d\n" % (
+        grid.shape[1], grid.shape[0], XLLCORNER, YLLCORNER, CELLSIZE, NODATA_VALUE)
+    with open(path_to_file, "w") as _:
+        _.write(header)
+        np.savetxt(_, grid, fmt="%d")
+
+def write_latlon_to_rowcol(path_to_file, nrows, ncols, climate_cellsize_km):
+    "regular lat/lon grid of climate cells covering the region with a margin, [[lat, lon], [crow, ccol]] pairs"
+    r_gk5 = np.array([XLLCORNER, XLLCORNER + ncols * CELLSIZE])
+    h_gk5 = np.array([YLLCORNER, YLLCORNER + nrows * CELLSIZE])
+    lons, lats = transform(climate_locator.GK5, climate_locator.WGS84, r_gk5, h_gk5)
+    lat_step = climate_cellsize_km / 111.0
+    lon_step = climate_cellsize_km / (111.0 * np.cos(np.radians(lats.mean())))
+    climate_lats = np.arange(lats.max() + lat_step, lats.min() - 2 * lat_step, -lat_step)
+    climate_lons = np.arange(lons.min() - lon_step, lons.max() + 2 * lon_step, lon_step)
+    latlon_to_rowcol = [[[round(lat, 5), round(lon, 5)], [crow, ccol]]
+                        for crow, lat in enumerate(climate_lats) for ccol, lon in enumerate(climate_lons)]
+    with open(path_to_file, "w") as _:
+        json.dump(latlon_to_rowcol, _)
+    return len(latlon_to_rowcol)
+
+def create_region(path_to_data_dir, region="bench", nrows=200, ncols=300, datacell_share=0.6, climate_cellsize_km=5.0, seed=0):
+    "write the grids and the climate mapping of a synthetic region, returns the number of datacells"
+    rng = np.random.RandomState(seed)
+    path_to_region_dir = os.path.join(path_to_data_dir, region)
+    path_to_csvs_dir = os.path.join(path_to_data_dir, "climate", "dwd", "csvs")
+    for path in [path_to_region_dir, path_to_csvs_dir]:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    mask = region_mask(rng, nrows, ncols, datacell_share)
+    for mmk_type, low, high, patch_size in MMK_TYPES:
+        if mmk_type == "dgm":
+            grid = elevation(rng, nrows, ncols)
+        else:
+            grid = patches(rng, nrows, ncols, low, high, patch_size)
+        grid[~mask] = NODATA_VALUE
+        write_grid(os.path.join(path_to_region_dir, mmk_type + "_" + region + "_100_gk5.asc"), grid)
+
+    write_latlon_to_rowcol(os.path.join(path_to_csvs_dir, "latlon_to_rowcol.json"), nrows, ncols, climate_cellsize_km)
+    return int(mask.sum())
+
+def main():
+    "write a synthetic region"
+
+    config = {
+        "data_dir": "bench_data/",
+        "region": "bench",
+        "nrows": "200",
+        "ncols": "300",
+        "datacell_share": "0.6", # about that share of the cells are datacells
+        "climate_cellsize_km": "5", # distance of the climate cells
+        "seed": "0"
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    no_of_datacells = create_region(config["data_dir"], config["region"], int(config["nrows"]), int(config["ncols"]),
+                                    float(config["datacell_share"]), float(config["climate_cellsize_km"]), int(config["seed"]))
+    print "wrote region", config["region"], "with", no_of_datacells, "datacells to", config["data_dir"]
+
+if __name__ == "__main__":
+    main()
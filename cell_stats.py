@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+per cell statistics over the years, updated as results arrive
+
+a result message brings the values of all years of its cells, so they are summarized right away
+and merged into the cell's running count, mean and m2 (chan's parallel form of welford's algorithm),
+min and max. percentiles are exact for cells which get their values from a single message,
+if a cell gets values from several messages the percentiles are count weighted averages
+"""
+
+import math
+import numpy as np
+
+def percentile(sorted_values, p):
+    "p-th percentile (0..100) of sorted values, linear interpolation like np.percentile"
+    pos = (len(sorted_values) - 1) * p / 100.0
+    lower = int(math.floor(pos))
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+class CellStats(object):
+    "running count, mean, variance, min, max and optionally percentiles of one result id for every cell of a grid"
+
+    def __init__(self, nrows, ncols, percentiles=()):
+        size = nrows * ncols
+        self.shape = (nrows, ncols)
+        self.count = np.zeros(size, dtype=np.int32)
+        self.mean = np.zeros(size, dtype=np.float64)
+        self.m2 = np.zeros(size, dtype=np.float64)
+        self.min = np.full(size, np.inf, dtype=np.float32)
+        self.max = np.full(size, -np.inf, dtype=np.float32)
+        self.percentiles = list(percentiles)
+        self.percentile_values = [np.zeros(size, dtype=np.float32) for _ in self.percentiles]
+
+    def update(self, rows, cols, values):
+        "add the values (e.g. of all years) of one result to the given cells"
+        if not values:
+            return
+        n_b = len(values)
+        mean_b = sum(values) / float(n_b)
+        m2_b = sum((value - mean_b) ** 2 for value in values)
+
+        indices = np.ravel_multi_index((np.asarray(rows), np.asarray(cols)), self.shape)
+        n_a = self.count[indices]
+        n = n_a + n_b
+        delta = mean_b - self.mean[indices]
+        self.mean[indices] += delta * n_b / n
+        self.m2[indices] += m2_b + delta ** 2 * n_a * n_b / n
+        self.min[indices] = np.minimum(self.min[indices], min(values))
+        self.max[indices] = np.maximum(self.max[indices], max(values))
+        self.count[indices] = n
+
+        if self.percentiles:
+            sorted_values = sorted(values)
+            for p, percentile_values in zip(self.percentiles, self.percentile_values):
+                percentile_values[indices] = (percentile_values[indices] * n_a + percentile(sorted_values, p) * n_b) / n
+
+    def summary_grids(self, nodata_value):
+        "dict of name -> grid for avg, std, min, max, cv and the percentiles, nodata where a cell got no value"
+        has_data = self.count > 0
+        std = np.sqrt(self.m2 / np.maximum(self.count, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cv = np.where(self.mean != 0, std / np.abs(self.mean), np.nan)
+        grids = [("avg", self.mean), ("std", std), ("min", self.min), ("max", self.max), ("cv", cv)]
+        for p, percentile_values in zip(self.percentiles, self.percentile_values):
+            grids.append(("p" + ("%g" % p), percentile_values))
+
+        result = {}
+        for name, values in grids:
+            grid = np.where(has_data & np.isfinite(values), values, nodata_value).astype(np.float64)
+            result[name] = grid.reshape(self.shape)
+        return result
+
+class ResultStats(object):
+    "cell statistics for every result id"
+
+    def __init__(self, nrows, ncols, percentiles=()):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.percentiles = percentiles
+        self.res_id_to_stats = {}
+
+    def update(self, year2crop_result, rows, cols):
+        "add the values of all years of one result message to the given cells, nodata years are skipped"
+        res_id_to_values = {}
+        for crop_result in year2crop_result.itervalues():
+            if not crop_result["isNoData"]:
+                for res_id, value in crop_result["values"].iteritems():
+                    res_id_to_values.setdefault(res_id, []).append(value)
+
+        for res_id, values in res_id_to_values.iteritems():
+            if res_id not in self.res_id_to_stats:
+                self.res_id_to_stats[res_id] = CellStats(self.nrows, self.ncols, self.percentiles)
+            self.res_id_to_stats[res_id].update(rows, cols, values)
+
+    def iteritems(self):
+        return iter(sorted(self.res_id_to_stats.iteritems()))
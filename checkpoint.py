@@ -0,0 +1,122 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+checkpoints of a consumer run, so a restarted consumer continues where the last one stopped
+
+a checkpoint directory holds
+- results.log: the received results appended as one json line {"cells": [[row, col], ...], "year2cropResult": ...} each
+- received.npy: bitmap (nrows, ncols) of the cells whose results are in results.log
+- state.json: grid shape, number of datacells and run_id
+received.npy and state.json are replaced atomically after results.log has been synced,
+so they never claim more than the log holds. the producer reads received.npy (resume_from=...)
+to send only the missing cells
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+RESULTS_LOG = "results.log"
+RECEIVED_BITMAP = "received.npy"
+STATE = "state.json"
+
+def replace_file(path_to_file, write):
+    "write a file via a temporary file and rename, write gets the open file"
+    tmp_path = path_to_file + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_path, "wb") as _:
+        write(_)
+        _.flush()
+        os.fsync(_.fileno())
+    os.rename(tmp_path, path_to_file)
+
+def load_received_bitmap(path_to_dir):
+    "bitmap of the cells received according to the checkpoint in path_to_dir, None if there is none"
+    path = os.path.join(path_to_dir, RECEIVED_BITMAP)
+    if not os.path.exists(path):
+        return None
+    return np.load(path).astype(bool)
+
+class Checkpoint(object):
+    "append the consumer's results to a log and write the received-cell bitmap every interval seconds"
+
+    def __init__(self, path_to_dir, nrows, ncols, interval=60):
+        self.path_to_dir = path_to_dir
+        self.shape = (nrows, ncols)
+        self.interval = interval
+        self.last_checkpoint_time = time.time()
+        self.state = {"nrows": nrows, "ncols": ncols, "ndatacells": None, "run_id": None}
+        if not os.path.isdir(path_to_dir):
+            os.makedirs(path_to_dir)
+        path_to_state = os.path.join(path_to_dir, STATE)
+        if os.path.exists(path_to_state):
+            with open(path_to_state) as _:
+                state = json.load(_)
+            if (state["nrows"], state["ncols"]) != self.shape:
+                raise ValueError("checkpoint in " + path_to_dir + " is for a " + str(state["nrows"]) + "x" + str(state["ncols"]) + " grid, not " + str(nrows) + "x" + str(ncols))
+            self.state = state
+        self.log = None
+
+    def replay(self):
+        """
+        yield (rows, cols, year2crop_result) of all logged results,
+        a last line cut off by a crash is dropped together with everything behind it
+        """
+        path_to_log = os.path.join(self.path_to_dir, RESULTS_LOG)
+        if not os.path.exists(path_to_log):
+            return
+        valid_size = 0
+        with open(path_to_log, "rb") as _:
+            for line in _:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+                yield [row for row, _ in record["cells"]], [col for _, col in record["cells"]], record["year2cropResult"]
+        if valid_size < os.path.getsize(path_to_log):
+            with open(path_to_log, "r+b") as _:
+                _.truncate(valid_size)
+
+    def add(self, rows, cols, year2crop_result):
+        "append a result to the log"
+        if self.log is None:
+            self.log = open(os.path.join(self.path_to_dir, RESULTS_LOG), "ab")
+        self.log.write(json.dumps({"cells": [[int(row), int(col)] for row, col in zip(rows, cols)], "year2cropResult": year2crop_result}) + "\n")
+
+    def due(self):
+        return time.time() - self.last_checkpoint_time >= self.interval
+
+    def write(self, received, ndatacells=None, run_id=None):
+        "sync the log, then write bitmap and state"
+        if self.log:
+            self.log.flush()
+            os.fsync(self.log.fileno())
+        replace_file(os.path.join(self.path_to_dir, RECEIVED_BITMAP), lambda _: np.save(_, received.astype(np.uint8)))
+        self.state["ndatacells"] = ndatacells
+        self.state["run_id"] = run_id
+        replace_file(os.path.join(self.path_to_dir, STATE), lambda _: json.dump(self.state, _))
+        self.last_checkpoint_time = time.time()
+
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
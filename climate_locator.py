@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import os
+import json
+import hashlib
+import cPickle as pickle
+import numpy as np
+from scipy.spatial import cKDTree
+from pyproj import Proj, transform
+
+import ascii_grid
+
+WGS84 = Proj(init="epsg:4326")
+#GK3 = Proj(init="epsg:3396")
+GK5 = Proj(init="epsg:31469")
+
+class ClimateLocator(object):
+    "nearest climate cell (crow, ccol) for gk5 coordinates"
+
+    def __init__(self, points, rowcols):
+        self.points = points
+        self.rowcols = rowcols
+        self.tree = cKDTree(points)
+
+    def locate(self, r_gk5, h_gk5):
+        "return (crows, ccols) arrays of the closest climate cells to the given gk5 coordinates"
+        points = np.column_stack((np.ravel(r_gk5), np.ravel(h_gk5)))
+        if len(points) == 0:
+            return np.array([], dtype=self.rowcols.dtype), np.array([], dtype=self.rowcols.dtype)
+        _, indices = self.tree.query(points)
+        rowcols = self.rowcols[indices]
+        return rowcols[:, 0], rowcols[:, 1]
+
+def create_climate_locator_from_json_file(path_to_latlon_to_rowcol_file, from_proj=WGS84, to_proj=GK5):
+    "project the json list of lat/lon to row/col mappings in one go and create a locator for it"
+    with open(path_to_latlon_to_rowcol_file) as _:
+        latlon_to_rowcol = json.load(_)
+
+    latlons = np.array([latlon for latlon, _ in latlon_to_rowcol], dtype=float).reshape(-1, 2)
+    rowcols = np.array([rowcol for _, rowcol in latlon_to_rowcol], dtype=int).reshape(-1, 2)
+
+    rs, hs = transform(from_proj, to_proj, latlons[:, 1], latlons[:, 0])
+    points = np.column_stack((rs, hs))
+    # points which can't be projected are dropped
+    valid = np.isfinite(points).all(axis=1)
+    return ClimateLocator(points[valid], rowcols[valid])
+
+def load_climate_locator(path_to_latlon_to_rowcol_file, path_to_cache_dir=None):
+    """
+    return climate locator for the json file,
+    if path_to_cache_dir is given, projected points and kd-tree are kept in a pickle file
+    which is rebuilt whenever path, size or mtime of the json file change
+    """
+    if not path_to_cache_dir:
+        return create_climate_locator_from_json_file(path_to_latlon_to_rowcol_file)
+
+    source = ascii_grid.source_key(path_to_latlon_to_rowcol_file)
+    name = "climate_locator_" + hashlib.sha1(source["path"].encode("utf-8")).hexdigest()[:10] + ".pickle"
+    path_to_cache_file = os.path.join(path_to_cache_dir, name)
+
+    try:
+        with open(path_to_cache_file, "rb") as _:
+            cached = pickle.load(_)
+        if cached["source"] == source:
+            return cached["locator"]
+    except (IOError, OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass
+
+    locator = create_climate_locator_from_json_file(path_to_latlon_to_rowcol_file)
+    if not os.path.isdir(path_to_cache_dir):
+        os.makedirs(path_to_cache_dir)
+    tmp_path = path_to_cache_file + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_path, "wb") as _:
+        pickle.dump({"source": source, "locator": locator}, _, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, path_to_cache_file)
+    return locator
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+wire format of envs and results
+
+plain json messages (the default) are sent as is, so workers which only know json keep working,
+all other messages start with a 4 byte header: MAGIC + format byte + compression byte,
+the receiver reads the message type from the header and needs no configuration
+"""
+
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+MAGIC = b"\x00Y"
+
+FORMATS = {"json": b"j", "msgpack": b"m"}
+COMPRESSIONS = {"": b"-", "zlib": b"z", "lz4": b"4"}
+
+def pack_year2crop_result(year2crop_result):
+    """
+    column oriented form of a year2cropResult which names every result id only once,
+    returns None if the crop results carry more than isNoData and values
+    """
+    years = sorted(year2crop_result.keys())
+    res_ids = set()
+    for crop_result in year2crop_result.itervalues():
+        if set(crop_result.keys()) - set(["isNoData", "values"]):
+            return None
+        res_ids.update(crop_result.get("values", {}).keys())
+    res_ids = sorted(res_ids)
+    return {
+        "years": years,
+        "resIds": res_ids,
+        "isNoData": [year2crop_result[year]["isNoData"] for year in years],
+        "values": [[year2crop_result[year].get("values", {}).get(res_id) for res_id in res_ids] for year in years]
+    }
+
+def unpack_year2crop_result(columns):
+    "year2cropResult from its column oriented form"
+    res_ids = columns["resIds"]
+    year2crop_result = {}
+    for year, is_no_data, values in zip(columns["years"], columns["isNoData"], columns["values"]):
+        year2crop_result[year] = {
+            "isNoData": is_no_data,
+            "values": dict([(res_id, value) for res_id, value in zip(res_ids, values) if value is not None])
+        }
+    return year2crop_result
+
+def _pack_message(msg):
+    if isinstance(msg, dict) and "year2cropResult" in msg:
+        columns = pack_year2crop_result(msg["year2cropResult"])
+        if columns is not None:
+            msg = dict(msg)
+            del msg["year2cropResult"]
+            msg["year2cropResultColumns"] = columns
+    return msg
+
+def _unpack_message(msg):
+    if isinstance(msg, dict) and "year2cropResultColumns" in msg:
+        msg["year2cropResult"] = unpack_year2crop_result(msg.pop("year2cropResultColumns"))
+    return msg
+
+def encode(msg, wire_format="json", compression=""):
+    "encode a message (or a list of messages) to bytes"
+    if wire_format == "json" and not compression:
+        return json.dumps(msg)
+
+    if wire_format == "msgpack":
+        if msgpack is None:
+            raise ImportError("msgpack format requested, but msgpack isn't installed")
+        payload = msgpack.packb([_pack_message(m) for m in msg] if isinstance(msg, list) else _pack_message(msg), use_bin_type=True)
+    elif wire_format == "json":
+        payload = json.dumps(msg)
+    else:
+        raise ValueError("unknown format: " + str(wire_format))
+
+    if compression == "zlib":
+        payload = zlib.compress(payload, 1)
+    elif compression == "lz4":
+        if lz4 is None:
+            raise ImportError("lz4 compression requested, but lz4 isn't installed")
+        payload = lz4.frame.compress(payload)
+    elif compression:
+        raise ValueError("unknown compression: " + str(compression))
+
+    return MAGIC + FORMATS[wire_format] + COMPRESSIONS[compression] + payload
+
+def decode(data, encoding="latin-1"):
+    "decode bytes created by encode or plain json"
+    if not data.startswith(MAGIC):
+        return json.loads(data, encoding=encoding)
+
+    wire_format, compression, payload = data[2:3], data[3:4], data[4:]
+    if compression == COMPRESSIONS["zlib"]:
+        payload = zlib.decompress(payload)
+    elif compression == COMPRESSIONS["lz4"]:
+        payload = lz4.frame.decompress(payload)
+    elif compression != COMPRESSIONS[""]:
+        raise ValueError("unknown compression byte: " + repr(compression))
+
+    if wire_format == FORMATS["msgpack"]:
+        msg = msgpack.unpackb(payload, raw=False)
+        return [_unpack_message(m) for m in msg] if isinstance(msg, list) else _unpack_message(msg)
+    elif wire_format == FORMATS["json"]:
+        return json.loads(payload, encoding=encoding)
+    raise ValueError("unknown format byte: " + repr(wire_format))
+
+def send(socket, msg, wire_format="json", compression=""):
+    "send message encoded with the given format and compression"
+    socket.send(encode(msg, wire_format, compression))
+
+def recv(socket, encoding="latin-1"):
+    "receive message in any of the supported formats"
+    return decode(socket.recv(), encoding)
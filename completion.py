@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+completion tracking of a run on the consumer side
+
+every cell of the grid is missing, received or failed (runFailed). the consumer knows the datacells
+of the run from the reference grid, so it doesn't depend on the ndatacells of the last env alone
+and can tell which cells never came back. the report of missing and failed cells is what the
+producer re-sends with resend_from=...
+"""
+
+import csv
+import time
+
+import numpy as np
+
+MISSING = 0
+RECEIVED = 1
+FAILED = 2
+
+STATUS_NAMES = {MISSING: "missing", RECEIVED: "received", FAILED: "failed"}
+
+def datacell_mask(ref_grid, nodata_value, start_row=0, end_row=-1):
+    "the datacells the producer selects (producer.select_datacells) as bool grid"
+    nrows = ref_grid.shape[0]
+    last_row = nrows - 1 if end_row < 0 else min(end_row, nrows - 1)
+    mask = np.zeros(ref_grid.shape, dtype=bool)
+    mask[start_row:last_row + 1] = ref_grid[start_row:last_row + 1] != nodata_value
+    return mask
+
+class CompletionTracker(object):
+    "status of every cell, a failed cell counts as done but can still be received by a re-send"
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.no_of_expected_cells = int(expected.sum())
+        self.status = np.zeros(expected.shape, dtype=np.uint8)
+        self.failure_reasons = {}
+        self.no_of_done_cells = 0
+        self.last_activity_time = time.time()
+
+    def new_cells(self, rows, cols):
+        "the (rows, cols) of the given cells without a result yet"
+        cells = [(row, col) for row, col in zip(rows, cols) if self.status[row, col] != RECEIVED]
+        return [row for row, _ in cells], [col for _, col in cells]
+
+    def set_received(self, rows, cols):
+        self.no_of_done_cells += int(np.count_nonzero(self.status[rows, cols] == MISSING))
+        self.status[rows, cols] = RECEIVED
+        for cell in zip(rows, cols):
+            self.failure_reasons.pop(cell, None)
+        self.last_activity_time = time.time()
+
+    def set_failed(self, rows, cols, reason):
+        "mark the missing ones of the cells as failed"
+        for row, col in zip(rows, cols):
+            if self.status[row, col] == MISSING:
+                self.status[row, col] = FAILED
+                self.failure_reasons[(row, col)] = reason
+                self.no_of_done_cells += 1
+        self.last_activity_time = time.time()
+
+    def received(self):
+        "bitmap of the cells with a result"
+        return self.status == RECEIVED
+
+    def counts(self):
+        "(received, failed, missing) number of datacells"
+        received = int(np.count_nonzero(self.status == RECEIVED))
+        failed = int(np.count_nonzero(self.status == FAILED))
+        missing = int(np.count_nonzero(self.expected & (self.status == MISSING)))
+        return received, failed, missing
+
+    def write_report(self, path_to_file):
+        "write the missing and failed datacells as csv (row, col, status, reason), returns their number"
+        rows, cols = np.nonzero(self.expected & (self.status != RECEIVED))
+        with open(path_to_file, "wb") as _:
+            writer = csv.writer(_)
+            writer.writerow(["row", "col", "status", "reason"])
+            for row, col in zip(rows, cols):
+                writer.writerow([row, col, STATUS_NAMES[self.status[row, col]], self.failure_reasons.get((row, col), "")])
+        return len(rows)
+
+def read_report(path_to_file):
+    "rows and cols of the cells in a report written by CompletionTracker.write_report"
+    rows = []
+    cols = []
+    with open(path_to_file, "rb") as _:
+        for record in csv.DictReader(_):
+            rows.append(int(record["row"]))
+            cols.append(int(record["col"]))
+    return np.array(rows, dtype=int), np.array(cols, dtype=int)
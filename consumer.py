@@ -21,6 +21,7 @@ import csv
 import types
 import os
 import json
+import time
 from datetime import datetime
 from collections import defaultdict, OrderedDict
 import numpy as np
@@ -28,6 +29,20 @@ import numpy as np
 import zmq
 #print "pyzmq version: ", zmq.pyzmq_version(), " zmq version: ", zmq.zmq_version()
 
+import ascii_grid
+import codec
+import flow_control
+import metrics
+import profiling
+import result_grids
+import cell_stats
+import checkpoint
+import completion
+import grid_writer
+import journal
+import job_plan
+import result_store
+
 LOCAL_CONSUMER = True
 
 PATHS = {
@@ -57,7 +72,32 @@ def run_consumer(path_to_output_dir = None, server = {"server": None, "port": No
         "start_row": "0",
         "end_row": "-1",
         "shared_id": shared_id,
-        "out": path_to_output_dir if path_to_output_dir else "out/" #None,
+        "out": path_to_output_dir if path_to_output_dir else "out/", #None,
+        "cache_dir": "cache/", # empty = don't use cached grid headers
+        "data_dir": "", # read the template grid from there instead of the user's data dir
+        "result_store": "", # path to sqlite result store shared with the producer
+        "run_id": "", # fill the cells of this producer run from the result store before receiving (taken from the first message if empty)
+        "progress_port": "", # publish the number of received cells on this port for the producer's flow control (max_in_flight)
+        "start_year": "1991", # years to preallocate result grids for, other years are added when they arrive
+        "end_year": "2012",
+        "result_grids_dir": "", # keep the result grids in memory-mapped files in this directory instead of ram
+        "write_year_grids": "true", # false = keep and write only the summaries over the years (_avg, _std, _min, _max, _cv)
+        "percentiles": "", # e.g. 10,50,90 = also write approximate percentile grids (_p10, _p50, _p90)
+        "output_formats": "asc", # comma separated: asc, npz (compressed numpy with header), tif (needs gdal)
+        "writer_threads": "4", # grids written concurrently at the end
+        "checkpoint_dir": "", # log received results there and resume from it on restart (the producer's resume_from)
+        "checkpoint_interval": "60", # seconds between syncing the result log and writing the received-cell bitmap
+        "idle_timeout": "", # seconds without results after which the missing and failed cells are written to missing_cells.csv in out
+        "idle_action": "wait", # after the idle report: wait = keep waiting for the producer to re-send them (resend_from), exit = write what has arrived
+        "metrics_interval": "10", # seconds between metrics log lines (results/s, failures, latency, eta)
+        "metrics_file": "", # also write the metrics there, .prom = prometheus text format, else json
+        "plan": "", # job plan the producer sends from (its write_plan), expect exactly its datacells, reject results of other plans
+        "journal": "", # append every received result message to this binary journal (see journal.py)
+        "replay_from": "", # rebuild grids and statistics from this journal instead of receiving results
+        "sweep": "false", # true = results of a producer sweep, each scenario gets grids, statistics and missing_cells.csv in out/<scenario id>/
+        "verbose": "false", # true = print a line per received result
+        "profile": "false", # true = time the run's phases incl. peak rss, cprofile = also dump a cProfile of the whole run
+        "profile_report": "" # path of the json profile report, default consumer_profile.json in out
     }
     if len(sys.argv) > 1 and __name__ == "__main__":
         for arg in sys.argv[1:]:
@@ -66,7 +106,7 @@ def run_consumer(path_to_output_dir = None, server = {"server": None, "port": No
                 config[k] = v
 
     paths = PATHS[config["user"]]
-    path_to_data_dir = paths["local_path_to_data_dir"] if LOCAL_CONSUMER else paths["cluster_path_to_data_dir"]
+    path_to_data_dir = config["data_dir"] or (paths["local_path_to_data_dir"] if LOCAL_CONSUMER else paths["cluster_path_to_data_dir"])
 
     print("consumer config:", config)
 
@@ -83,21 +123,20 @@ def run_consumer(path_to_output_dir = None, server = {"server": None, "port": No
     leave = False
     write_normal_output_files = False
 
-    def read_header(path_to_ascii_grid_file):
-        "read metadata from esri ascii grid file"
-        metadata = {}
-        header_str = ""
-        with open(path_to_ascii_grid_file) as _:
-            for i in range(0, 6):
-                line = _.readline()
-                header_str += line
-                sline = [x for x in line.split() if len(x) > 0]
-                if len(sline) > 1:
-                    metadata[sline[0].strip().lower()] = float(sline[1].strip())
-        return metadata, header_str
-
-    template_metadata, template_header = read_header(path_to_data_dir + config["region"] + "/" + config["ref_mmk_type"] + "_" + config["region"] + "_100_gk5.asc")
-    print("read template metadata from:", path_to_data_dir + config["region"] + "/" + config["ref_mmk_type"] + "_" + config["region"] + "_100_gk5.asc")
+    profiler = profiling.Profiler("consumer", config["profile"], config["profile_report"] or config["out"] + "consumer_profile.json")
+
+    plan = None
+    if config["plan"]:
+        # the plan has the template's header and all datacells, the grid isn't needed
+        with profiler.phase("read_plan"):
+            plan = job_plan.read_plan(config["plan"])
+        template_metadata = plan["info"]["metadata"]
+        template_header = plan["info"]["header"]
+        print("read plan of", plan["no_of_datacells"], "datacells from:", config["plan"], "- content hash:", plan["hash"])
+    else:
+        with profiler.phase("read_template"):
+            ref_grid, template_metadata, template_header = ascii_grid.read_grid(path_to_data_dir + config["region"] + "/" + config["ref_mmk_type"] + "_" + config["region"] + "_100_gk5.asc", path_to_cache_dir=config["cache_dir"])
+        print("read template grid from:", path_to_data_dir + config["region"] + "/" + config["ref_mmk_type"] + "_" + config["region"] + "_100_gk5.asc")
 
     start_row = int(config["start_row"])
     end_row = int(config["end_row"])
@@ -105,40 +144,208 @@ def run_consumer(path_to_output_dir = None, server = {"server": None, "port": No
     ncols = int(template_metadata["ncols"])
     nodata_value = int(template_metadata["nodata_value"])
     
-    new_grid = lambda: np.full((nrows, ncols), nodata_value)
-    grids = defaultdict(lambda: defaultdict(new_grid))
-    
+    years = range(int(config["start_year"]), int(config["end_year"]) + 1)
+    percentiles = [float(percentile) for percentile in config["percentiles"].split(",") if percentile]
+    if plan:
+        datacells = np.zeros((nrows, ncols), dtype=bool)
+        datacells[plan["records"]["row"], plan["records"]["col"]] = True
+    else:
+        datacells = completion.datacell_mask(ref_grid, nodata_value, start_row, end_row)
+    # counted once, progress() runs for every result
+    no_of_expected_datacells = int(datacells.sum())
+    sweep = config["sweep"] == "true"
+
+    # the outputs of the run or, in a sweep, of every scenario so far
+    scenarios = OrderedDict()
+    start_time = time.time()
+
+    def get_scenario(scenario_id):
+        "grids, statistics and completion of the scenario, created on its first result"
+        if scenario_id not in scenarios:
+            grids = None
+            if config["write_year_grids"] == "true":
+                path_to_grids_dir = config["result_grids_dir"] or None
+                if path_to_grids_dir and scenario_id:
+                    path_to_grids_dir = os.path.join(path_to_grids_dir, scenario_id)
+                grids = result_grids.ResultGrids(nrows, ncols, nodata_value, years, path_to_grids_dir)
+            scenarios[scenario_id] = {
+                "out": config["out"] + scenario_id + "/" if scenario_id else config["out"],
+                "grids": grids,
+                "stats": cell_stats.ResultStats(nrows, ncols, percentiles),
+                # results for cells which already have one (e.g. after resuming) are ignored
+                "tracker": completion.CompletionTracker(datacells),
+                "no_of_datacells": plan["no_of_datacells"] if plan else None
+            }
+            if scenario_id:
+                print("receiving scenario:", scenario_id)
+        return scenarios[scenario_id]
+
+    # outside of a sweep everything goes to the run's scenario ""
+    run_scenario = None if sweep else get_scenario("")
+    run_checkpoint = None
+    if config["checkpoint_dir"]:
+        if sweep:
+            print("checkpoints aren't supported in sweep mode, ignoring checkpoint_dir")
+        else:
+            run_checkpoint = checkpoint.Checkpoint(config["checkpoint_dir"], nrows, ncols, float(config["checkpoint_interval"]))
+
+    def write_result(scenario, year2crop_result, rows, cols, log=True):
+        "write the results of one env into the scenario's grids and statistics at the given cells"
+        scenario["tracker"].set_received(rows, cols)
+        if run_checkpoint and log:
+            run_checkpoint.add(rows, cols, year2crop_result)
+        grids = scenario["grids"]
+        if grids:
+            for year, crop_result in year2crop_result.iteritems():
+                if not crop_result["isNoData"]:
+                    for res_id, value in crop_result["values"].iteritems():
+                        grids.set(year, res_id, rows, cols, value)
+        scenario["stats"].update(year2crop_result, rows, cols)
+
+    store = result_store.ResultStore(config["result_store"]) if config["result_store"] else None
+    results_to_store = []
+
+    def store_results():
+        "write the buffered new results to the result store in one transaction"
+        if store and results_to_store:
+            store.put(results_to_store)
+            del results_to_store[:]
+
+    def fill_from_store(scenario, run_id):
+        "write the results of all cells the producer served from the result store and count them as received"
+        ndatacells, cached_cells = store.run_info(run_id)
+        if ndatacells is None:
+            print("run_id:", run_id, "is unknown to the result store")
+            return
+        scenario["no_of_datacells"] = ndatacells
+        hash_to_cells = defaultdict(list)
+        for row, col, env_hash in cached_cells:
+            hash_to_cells[env_hash].append((row, col))
+        no_of_filled_cells = 0
+        for env_hash, year2crop_result in store.get(hash_to_cells.keys()).iteritems():
+            cells = hash_to_cells[env_hash]
+            rows, cols = scenario["tracker"].new_cells([row for row, _ in cells], [col for _, col in cells])
+            if rows:
+                write_result(scenario, year2crop_result, rows, cols)
+                no_of_filled_cells += len(rows)
+        print("filled", no_of_filled_cells, "of", ndatacells, "datacells of run_id:", run_id, "from result store")
+
+    consumer_metrics = metrics.Metrics("consumer", float(config["metrics_interval"]), config["metrics_file"] or None)
+    verbose = config["verbose"] == "true"
+    replaying = bool(config["replay_from"])
+    result_journal = journal.JournalWriter(config["journal"]) if config["journal"] and not replaying else None
+
+    def no_of_datacells(scenario):
+        return scenario["no_of_datacells"] or scenario["tracker"].no_of_expected_cells
+
+    def complete():
+        "true if all datacells of the run (of all scenarios of the sweep) are received or failed"
+        if sweep and (not process_message.no_of_scenarios or len(scenarios) < process_message.no_of_scenarios):
+            return False
+        return all(scenario["tracker"].no_of_done_cells >= no_of_datacells(scenario) for scenario in scenarios.itervalues())
+
+    def progress():
+        "(done, total) datacells over all scenarios, the scenarios of a sweep which haven't started count with all datacells"
+        no_of_scenarios = max(len(scenarios), process_message.no_of_scenarios or 0)
+        done = sum(scenario["tracker"].no_of_done_cells for scenario in scenarios.itervalues())
+        total = sum(no_of_datacells(scenario) for scenario in scenarios.itervalues()) + (no_of_scenarios - len(scenarios)) * no_of_expected_datacells
+        return done, total
+
+    def last_activity_time():
+        return max([scenario["tracker"].last_activity_time for scenario in scenarios.itervalues()] or [start_time])
+
+    def report_incomplete():
+        "write the missing and failed datacells to missing_cells.csv (of every scenario)"
+        for scenario_id, scenario in scenarios.iteritems():
+            if not os.path.isdir(scenario["out"]):
+                os.makedirs(scenario["out"])
+            path_to_report = scenario["out"] + "missing_cells.csv"
+            no_of_cells = scenario["tracker"].write_report(path_to_report)
+            received, failed, missing = scenario["tracker"].counts()
+            print((scenario_id + ": " if scenario_id else "") + "received:", received, "failed:", failed, "missing:", missing, "datacells, wrote", no_of_cells, "cells to", path_to_report, "(producer: resend_from=" + path_to_report + ")")
+
     def process_message(msg):
 
         leave = False
 
         if msg["type"] == "finish":
             print("c: received finish message")
-            leave = True
+            custom_id = msg.get("customId", {})
+            if store and "runId" in custom_id:
+                # the producer had nothing to send, all datacells of the run are in the result store
+                scenario = get_scenario(custom_id.get("scenario", "")) if sweep else run_scenario
+                if sweep and "noOfScenarios" in custom_id:
+                    process_message.no_of_scenarios = custom_id["noOfScenarios"]
+                if custom_id["runId"] not in process_message.filled_run_ids:
+                    process_message.run_id = custom_id["runId"]
+                    process_message.filled_run_ids.add(process_message.run_id)
+                    fill_from_store(scenario, process_message.run_id)
+                leave = complete()
+                consumer_metrics.set_progress(*progress())
+            else:
+                leave = True
 
         elif not write_normal_output_files:
 
-            process_message.received_env_count += 1
-            
             custom_id = msg["customId"]
-                        
-            row = custom_id["row"]
-            col = custom_id["col"]
-            if not process_message.no_of_datacells:
-                process_message.no_of_datacells = custom_id.get("ndatacells", None)
-            
-            leave = process_message.no_of_datacells == process_message.received_env_count
-
-            print("env-count/no-datacells:", process_message.received_env_count, "/", process_message.no_of_datacells, ", leave:", leave)
+            scenario = get_scenario(custom_id.get("scenario", "")) if sweep else run_scenario
+            tracker = scenario["tracker"]
+            if sweep and "noOfScenarios" in custom_id:
+                process_message.no_of_scenarios = custom_id["noOfScenarios"]
+
+            # deduplicated envs carry all the cells they stand for
+            cells = custom_id.get("cells", [[custom_id["row"], custom_id["col"]]])
+            rows = [row for row, _ in cells]
+            cols = [col for _, col in cells]
+
+            if store and "runId" in custom_id and custom_id["runId"] not in process_message.filled_run_ids:
+                process_message.run_id = custom_id["runId"]
+                process_message.filled_run_ids.add(process_message.run_id)
+                fill_from_store(scenario, process_message.run_id)
+
+            process_message.received_result_cells += len(cells)
+            consumer_metrics.inc("results")
+            consumer_metrics.inc("cells", len(cells))
+            if "sendTime" in custom_id and not replaying:
+                consumer_metrics.observe_latency(time.time() - custom_id["sendTime"])
+            if not scenario["no_of_datacells"]:
+                scenario["no_of_datacells"] = custom_id.get("ndatacells", None)
+                if scenario["no_of_datacells"] and scenario["no_of_datacells"] != tracker.no_of_expected_cells:
+                    print("warning: producer sends", scenario["no_of_datacells"], "datacells, but the reference grid has", tracker.no_of_expected_cells, "(check region, start_row and end_row)")
+
+            if plan:
+                # results of another plan or for cells outside of it don't belong to this run
+                if custom_id.get("planHash", plan_id) == plan_id:
+                    in_plan = [(row, col) for row, col in zip(rows, cols) if datacells[row, col]]
+                else:
+                    in_plan = []
+                if len(in_plan) < len(rows):
+                    consumer_metrics.inc("rejected_cells", len(rows) - len(in_plan))
+                    if not process_message.rejected_results or verbose:
+                        print("warning: rejected result not matching plan", config["plan"], "customId:", custom_id)
+                    process_message.rejected_results += 1
+                rows = [row for row, _ in in_plan]
+                cols = [col for _, col in in_plan]
+
+            rows, cols = tracker.new_cells(rows, cols)
 
             if msg["runFailed"]:
                 print("run with customId:", custom_id, "failed. Reason:", msg["reasonForRunFailed"])
-                return leave
+                consumer_metrics.inc("failures")
+                tracker.set_failed(rows, cols, msg["reasonForRunFailed"])
+            elif rows:
+                write_result(scenario, msg["year2cropResult"], rows, cols)
 
-            for year, crop_result in msg["year2cropResult"].iteritems():
-                if not crop_result["isNoData"]:
-                    for res_id, value in crop_result["values"].iteritems():
-                        grids[year][res_id][row, col] = value
+            leave = complete()
+            consumer_metrics.set_progress(*progress())
+
+            if verbose:
+                print("env-count/no-datacells:", tracker.no_of_done_cells, "/", scenario["no_of_datacells"], ", leave:", leave)
+
+            if not msg["runFailed"] and rows and store and "envHash" in custom_id:
+                results_to_store.append((custom_id["envHash"], msg["year2cropResult"]))
+                if len(results_to_store) >= 1000 or leave:
+                    store_results()
             
             #if process_message.received_env_count % 10 == 0:
             #print process_message.received_env_count, "/", process_message.no_of_datacells,
@@ -152,32 +359,145 @@ def run_consumer(path_to_output_dir = None, server = {"server": None, "port": No
 
         return leave
 
-    process_message.no_of_datacells = None
+    process_message.no_of_scenarios = None
     process_message.received_env_count = 0
+    process_message.run_id = None
+    process_message.received_result_cells = 0
+    process_message.filled_run_ids = set()
+    process_message.rejected_results = 0
+    plan_id = job_plan.plan_id(plan["hash"]) if plan else None
+
+    def process_data(data):
+        "decode a received message and process the result(s) in it"
+        try:
+            with profiler.phase("decode"):
+                msg = codec.decode(data, encoding="latin-1")
+        except Exception as e:
+            print(e)
+            return False
+        leave = False
+        # batched results arrive as json array
+        with profiler.phase("update"):
+            for result_msg in (msg if isinstance(msg, list) else [msg]):
+                try:
+                    leave = process_message(result_msg) or leave
+                except Exception as e:
+                    print(e)
+        return leave
 
+    def write_checkpoint():
+        store_results()
+        if result_journal:
+            result_journal.flush(sync=True)
+        run_checkpoint.write(run_scenario["tracker"].received(), run_scenario["no_of_datacells"], process_message.run_id)
+
+    if run_checkpoint:
+        with profiler.phase("resume"):
+            for rows, cols, year2crop_result in run_checkpoint.replay():
+                write_result(run_scenario, year2crop_result, rows, cols, log=False)
+        run_scenario["no_of_datacells"] = run_checkpoint.state["ndatacells"]
+        if run_checkpoint.state["run_id"]:
+            process_message.run_id = run_checkpoint.state["run_id"]
+            process_message.filled_run_ids.add(run_checkpoint.state["run_id"])
+        if run_scenario["tracker"].no_of_done_cells:
+            print("resumed", run_scenario["tracker"].no_of_done_cells, "of", run_scenario["no_of_datacells"], "datacells from checkpoint:", config["checkpoint_dir"])
+        leave = complete()
+
+    progress_publisher = flow_control.ProgressPublisher(context, config["progress_port"]) if config["progress_port"] else None
+
+    if store and config["run_id"] and config["run_id"] not in process_message.filled_run_ids and not sweep:
+        process_message.run_id = config["run_id"]
+        process_message.filled_run_ids.add(process_message.run_id)
+        with profiler.phase("fill_from_store"):
+            fill_from_store(run_scenario, process_message.run_id)
+        leave = complete()
+
+    if replaying:
+        # all of the journal, a failed cell might have been re-sent successfully after the run looked complete
+        no_of_messages = 0
+        with profiler.phase("replay"):
+            for _, data in journal.read_journal(config["replay_from"]):
+                process_data(data)
+                no_of_messages += 1
+                consumer_metrics.tick()
+        print("replayed", no_of_messages, "messages from journal:", config["replay_from"])
+        leave = True
+
+    idle_timeout = float(config["idle_timeout"]) if config["idle_timeout"] else None
+    reported_idle_since = None
     while not leave:
+        if run_checkpoint and run_checkpoint.due():
+            with profiler.phase("checkpoint"):
+                write_checkpoint()
+        consumer_metrics.tick()
+        # wake up regularly for the metrics, checkpoints and idle timeout,
+        # also publish the final count of a burst, not only while results are coming in
+        with profiler.phase("wait"):
+            idle = not socket.poll(200)
+        if idle:
+            if result_journal:
+                result_journal.flush()
+            if progress_publisher:
+                progress_publisher.publish(process_message.received_result_cells, force=True)
+            if idle_timeout and time.time() - last_activity_time() > idle_timeout and reported_idle_since != last_activity_time():
+                print("no results for", idle_timeout, "s")
+                report_incomplete()
+                reported_idle_since = last_activity_time()
+                leave = config["idle_action"] == "exit"
+            continue
         try:
-            msg = socket.recv_json(encoding="latin-1")
-            leave = process_message(msg)
+            with profiler.phase("receive"):
+                data = socket.recv()
         except Exception as e: 
             print(e)
             continue
-
-    res_id_to_avgs = {}
-    for year, res_id_to_grid in grids.iteritems():
-        for res_id, grid in res_id_to_grid.iteritems():
-            if res_id not in res_id_to_avgs:
-                res_id_to_avgs[res_id] = (np.full((nrows, ncols), 0.0), 0)
-            res_id_to_avgs[res_id] = (res_id_to_avgs[res_id][0] + grid, res_id_to_avgs[res_id][1] + 1)
-
-            np.savetxt(config["out"] + res_id + "_" + str(year) + ".asc", grid, delimiter=" ", fmt="%.2f", header=template_header.strip(), comments="")
-
-    for res_id, (avg_grid, count) in res_id_to_avgs.iteritems():
-        avg = avg_grid / count
-
-        np.savetxt(config["out"] + res_id + "_avg.asc", avg, delimiter=" ", fmt="%.2f", header=template_header.strip(), comments="")
-
-
+        if result_journal:
+            result_journal.append(data, time.time())
+        leave = process_data(data) or leave
+        if progress_publisher:
+            progress_publisher.publish(process_message.received_result_cells)
+
+    consumer_metrics.log()
+
+    if run_checkpoint:
+        write_checkpoint()
+        run_checkpoint.close()
+
+    if any(sum(scenario["tracker"].counts()[1:]) for scenario in scenarios.itervalues()):
+        report_incomplete()
+
+    if store:
+        store_results()
+        store.close()
+
+    if result_journal:
+        result_journal.close()
+        print("journaled", result_journal.no_of_records, "messages to:", config["journal"])
+
+    if progress_publisher:
+        progress_publisher.publish(process_message.received_result_cells, force=True)
+        progress_publisher.close()
+
+    jobs = []
+    for scenario in scenarios.itervalues():
+        path_to_out_dir = scenario["out"]
+        if not os.path.isdir(path_to_out_dir):
+            os.makedirs(path_to_out_dir)
+        if scenario["grids"]:
+            for year, res_id, grid in scenario["grids"].iteritems():
+                jobs.append((path_to_out_dir + res_id + "_" + str(year), grid))
+
+        # summaries over the years, cells without any value are nodata
+        with profiler.phase("summaries"):
+            for res_id, res_id_stats in scenario["stats"].iteritems():
+                for name, grid in sorted(res_id_stats.summary_grids(nodata_value).iteritems()):
+                    jobs.append((path_to_out_dir + res_id + "_" + name, grid))
+
+    with profiler.phase("write_grids"):
+        grid_writer.write_grids(jobs, template_header, template_metadata,
+                                formats=config["output_formats"].split(","), threads=int(config["writer_threads"]))
+
+    profiler.write_report()
     print("exiting run_consumer()")
     #debug_file.close()
 
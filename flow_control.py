@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+credit based flow control between producer and consumer
+
+the consumer publishes the number of cells it received from the workers on a PUB socket,
+the producer subscribes to it and holds back envs while more than max_in_flight cells are unanswered
+"""
+
+import time
+import json
+
+import zmq
+
+class ProgressPublisher(object):
+    "consumer side: publish the number of received cells, at most every min_interval seconds"
+
+    def __init__(self, context, port, min_interval=0.2):
+        self.socket = context.socket(zmq.PUB)
+        self.socket.bind("tcp://*:" + str(port))
+        self.min_interval = min_interval
+        self.last_publish_time = 0
+
+    def publish(self, received_cells, force=False):
+        now = time.time()
+        if force or now - self.last_publish_time >= self.min_interval:
+            self.socket.send(json.dumps({"received": received_cells}))
+            self.last_publish_time = now
+
+    def close(self):
+        self.socket.close(linger=0)
+
+class CreditGate(object):
+    "producer side: block sending while sent cells - cells received by the consumer >= max_in_flight"
+
+    def __init__(self, context, server, port, max_in_flight, stall_timeout=60):
+        self.socket = context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.SUBSCRIBE, b"")
+        self.socket.connect("tcp://" + server + ":" + str(port))
+        self.max_in_flight = max_in_flight
+        self.stall_timeout = stall_timeout
+        self.acked_cells = 0
+        self.written_off_cells = 0
+
+    def _update(self, timeout_ms):
+        "read all pending progress messages, waiting at most timeout_ms for the first, true if there was one"
+        updated = False
+        while self.socket.poll(timeout_ms if not updated else 0):
+            self.acked_cells = max(self.acked_cells, json.loads(self.socket.recv())["received"])
+            updated = True
+        return updated
+
+    def in_flight(self, sent_cells):
+        return sent_cells - self.acked_cells - self.written_off_cells
+
+    def wait_for_credit(self, sent_cells):
+        """
+        wait until less than max_in_flight cells are unanswered,
+        after stall_timeout seconds without progress the cells in flight are written off as lost,
+        so lost results can't stop the producer
+        """
+        self._update(0)
+        last_progress_time = time.time()
+        while self.in_flight(sent_cells) >= self.max_in_flight:
+            if self._update(1000):
+                last_progress_time = time.time()
+            elif time.time() - last_progress_time > self.stall_timeout:
+                print "no progress from consumer for", self.stall_timeout, "s, writing off", self.in_flight(sent_cells), "cells in flight as lost"
+                self.written_off_cells += self.in_flight(sent_cells)
+                return
+
+    def close(self):
+        self.socket.close(linger=0)
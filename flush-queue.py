@@ -17,18 +17,23 @@
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
 import sys
+import time
 #print sys.path
 
 import zmq
 #print "pyzmq version: ", zmq.pyzmq_version(), " zmq version: ", zmq.zmq_version()
 
+import codec
+import journal
+
 def main():
-    "simply empty queue"
+    "simply empty queue, or drain it into a result journal"
 
     config = {
         "port": "7777",
         "server": "localhost",
-        "shared_id": None
+        "shared_id": None,
+        "journal": "" # append the messages to this result journal instead of throwing them away (consumer.py replay_from=...)
     }
     if len(sys.argv) > 1:
         for arg in sys.argv[1:]:
@@ -45,11 +50,28 @@ def main():
 
     socket.connect("tcp://" + config["server"] + ":" + config["port"])
 
+    result_journal = journal.JournalWriter(config["journal"]) if config["journal"] else None
+
     i = 0
-    while True:
-        socket.recv_json(encoding="latin-1")
-        if i%10 == 0:
-            print i,
-        i = i + 1
+    try:
+        while True:
+            if result_journal:
+                # keep the buffer on disk while the queue is quiet
+                if not socket.poll(1000):
+                    result_journal.flush()
+                    continue
+                result_journal.append(socket.recv(), time.time())
+            else:
+                codec.recv(socket, encoding="latin-1")
+            if i%10 == 0:
+                print i,
+            i = i + 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if result_journal:
+            result_journal.close()
+            print
+            print "drained", result_journal.no_of_records, "messages to:", config["journal"]
 
 main()
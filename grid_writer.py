@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+fast writer for the consumer's output grids
+
+the esri ascii grids are formatted in chunks of rows with numpy instead of a "%.2f" per value,
+the output is byte for byte what np.savetxt(..., delimiter=" ", fmt="%.2f") writes
+"""
+
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+try:
+    from osgeo import gdal, osr
+except ImportError:
+    gdal = None
+
+def format_values(values, decimals=2):
+    """
+    format a 2d array like ("%." + decimals + "f") % value per value, values separated by " " and rows ended by newline,
+    returns the bytes of the text
+    """
+    values = np.asarray(values, dtype=np.float64)
+    nrows, ncols = values.shape
+    flat = values.ravel()
+    scale = 10 ** decimals
+
+    finite = np.isfinite(flat)
+    scaled = np.where(finite, flat, 0) * scale
+    fixed = np.rint(scaled)
+    # values close to a rounding boundary or too large for int64 are formatted by python, to round exactly like it
+    fallback = ~finite | (np.abs(np.abs(scaled - fixed) - 0.5) < 1e-6) | (np.abs(scaled) >= 1e17)
+    digits_value = np.abs(np.where(fallback, 0, fixed)).astype(np.int64)
+    negative = np.signbit(flat)
+
+    if len(flat) and digits_value.max() < 2 ** 31:
+        # int32 divisions are a lot faster
+        digits_value = digits_value.astype(np.int32)
+    int_part = digits_value // scale
+    no_of_int_digits = np.ones(len(flat), dtype=np.int8)
+    threshold = 10
+    while len(flat) and threshold <= int_part.max():
+        no_of_int_digits += int_part >= threshold
+        threshold *= 10
+    lengths = negative + no_of_int_digits + (decimals + 1 if decimals > 0 else 0)
+
+    fallback_strs = {}
+    for i in np.nonzero(fallback)[0]:
+        fallback_strs[i] = ("%." + str(decimals) + "f") % flat[i]
+        lengths[i] = len(fallback_strs[i])
+
+    # right aligned characters of every value plus one separator, built position by position (rows of chars)
+    # and transposed at the end, 0 = unused
+    width = int(lengths.max()) if len(flat) else 0
+    chars = np.empty((width + 1, len(flat)), dtype=np.uint8)
+    # np.where is slow for uint8, masks are applied by multiplying with them
+    digit_chars = np.frombuffer(b"0123456789", dtype=np.uint8)
+    sign_chars = negative.view(np.uint8) * np.uint8(ord("-"))
+    remaining = digits_value
+    pos = width - 1
+    for _ in range(decimals):
+        remaining, last_digit = np.divmod(remaining, 10)
+        chars[pos] = digit_chars.take(last_digit)
+        pos -= 1
+    if decimals > 0:
+        chars[pos] = ord(".")
+        pos -= 1
+    digit = 0
+    while pos >= 0:
+        # leading positions are a digit, the minus sign or unused
+        remaining, last_digit = np.divmod(remaining, 10)
+        chars[pos] = digit_chars.take(last_digit) * (digit < no_of_int_digits).view(np.uint8)
+        chars[pos] += sign_chars * (digit == no_of_int_digits).view(np.uint8)
+        digit += 1
+        pos -= 1
+
+    separators = np.full((nrows, ncols), ord(" "), dtype=np.uint8)
+    separators[:, -1] = ord("\n")
+    chars[width] = separators.ravel()
+    chars = chars.T.copy()
+    for i, text in fallback_strs.iteritems():
+        chars[i, :width] = 0
+        chars[i, width - len(text):width] = np.frombuffer(text, dtype=np.uint8)
+    return chars[chars != 0].tobytes()
+
+def write_ascii_grid(path_to_file, grid, header, decimals=2, chunk_cells=65536):
+    "write grid as esri ascii grid file, formatting about chunk_cells cells (whole rows) at a time"
+    chunk_rows = max(1, chunk_cells // grid.shape[1])
+    with open(path_to_file, "wb") as _:
+        _.write(header.strip() + "\n")
+        for start in range(0, grid.shape[0], chunk_rows):
+            _.write(format_values(grid[start:start + chunk_rows], decimals))
+
+def write_npz_grid(path_to_file, grid, metadata):
+    "write grid compressed with its esri header metadata"
+    np.savez_compressed(path_to_file, grid=np.asarray(grid, dtype=np.float32), **dict([(str(k), v) for k, v in metadata.iteritems()]))
+
+def write_geotiff_grid(path_to_file, grid, metadata, epsg=31469):
+    "write grid as single band float32 geotiff (needs gdal)"
+    if gdal is None:
+        raise ImportError("geotiff output requested, but gdal isn't installed")
+    nrows, ncols = grid.shape
+    cellsize = float(metadata["cellsize"])
+    dataset = gdal.GetDriverByName("GTiff").Create(path_to_file, ncols, nrows, 1, gdal.GDT_Float32, ["COMPRESS=DEFLATE"])
+    dataset.SetGeoTransform((float(metadata["xllcorner"]), cellsize, 0, float(metadata["yllcorner"]) + nrows * cellsize, 0, -cellsize))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    dataset.SetProjection(srs.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(float(metadata["nodata_value"]))
+    band.WriteArray(np.asarray(grid, dtype=np.float32))
+    dataset.FlushCache()
+
+def write_grids(jobs, header, metadata, formats=("asc",), threads=4, decimals=2):
+    """
+    write the (path without extension, grid) jobs in all formats (asc, npz, tif) concurrently,
+    numpy formatting and file io release the gil, so threads suffice
+    """
+    tasks = []
+    for path, grid in jobs:
+        for output_format in formats:
+            if output_format == "asc":
+                tasks.append((write_ascii_grid, (path + ".asc", grid, header, decimals)))
+            elif output_format == "npz":
+                tasks.append((write_npz_grid, (path + ".npz", grid, metadata)))
+            elif output_format == "tif":
+                tasks.append((write_geotiff_grid, (path + ".tif", grid, metadata)))
+            else:
+                raise ValueError("unknown output format: " + str(output_format))
+
+    if threads <= 1:
+        for function, args in tasks:
+            function(*args)
+        return
+
+    pool = ThreadPool(threads)
+    try:
+        for result in [pool.apply_async(function, args) for function, args in tasks]:
+            result.get()
+    finally:
+        pool.close()
+        pool.join()
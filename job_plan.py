@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+binary job plan: every datacell of a region's row range with its sampled values, shared by producer and consumer
+
+the file starts with MAGIC, followed by a HEADER (number of datacells, sha256 content hash, length of the info),
+the info (json: region, ref_mmk_type, start_row, end_row, reference grid header and the record fields)
+and one fixed size record of little endian int32 per datacell in row-major order.
+the content hash covers the info and the records.
+
+the producer writes it with write_plan=... and sends from it with plan=..., its shards cut it by index range,
+the consumer with plan=... expects exactly its datacells and rejects results of other plans
+"""
+
+import os
+import json
+import struct
+import hashlib
+
+import numpy as np
+
+MAGIC = b"YSPLAN1\n"
+HEADER = struct.Struct("<Q32sI")
+
+def record_dtype(fields):
+    return np.dtype([(str(name), "<i4") for name in fields])
+
+def plan_id(content_hash):
+    "the short form of the content hash the envs carry"
+    return content_hash[:16]
+
+class PlanWriter(object):
+    "write a plan part by part, the file appears complete with count and content hash on close()"
+
+    def __init__(self, path_to_file, info, fields):
+        self.path_to_file = path_to_file
+        self.dtype = record_dtype(fields)
+        self.info_bytes = json.dumps(dict(info, fields=list(fields)), sort_keys=True).encode("utf-8")
+        self.sha = hashlib.sha256(self.info_bytes)
+        self.no_of_datacells = 0
+        path_to_dir = os.path.dirname(path_to_file)
+        if path_to_dir and not os.path.isdir(path_to_dir):
+            os.makedirs(path_to_dir)
+        self.file = open(path_to_file + ".tmp", "wb")
+        self.file.write(MAGIC)
+        self.file.write(HEADER.pack(0, b"\0" * 32, len(self.info_bytes)))
+        self.file.write(self.info_bytes)
+
+    def append(self, arrays):
+        "append the datacells of a dict of equally long arrays holding all fields"
+        records = np.empty(len(arrays["row"]), dtype=self.dtype)
+        for name in self.dtype.names:
+            records[name] = arrays[name]
+        data = records.tobytes()
+        self.sha.update(data)
+        self.file.write(data)
+        self.no_of_datacells += len(records)
+
+    def close(self):
+        "fill in count and hash, returns the content hash"
+        self.file.seek(len(MAGIC))
+        self.file.write(HEADER.pack(self.no_of_datacells, self.sha.digest(), len(self.info_bytes)))
+        self.file.close()
+        os.rename(self.path_to_file + ".tmp", self.path_to_file)
+        return self.sha.hexdigest()
+
+def read_plan(path_to_file, verify=True):
+    """
+    open a plan, the records are memory-mapped,
+    returns {"info", "hash" (hex), "no_of_datacells", "records"}, raises ValueError if verify finds it damaged
+    """
+    with open(path_to_file, "rb") as _:
+        if _.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path_to_file + " is not a job plan")
+        no_of_datacells, digest, info_length = HEADER.unpack(_.read(HEADER.size))
+        info_bytes = _.read(info_length)
+    info = json.loads(info_bytes.decode("utf-8"))
+    dtype = record_dtype(info["fields"])
+    offset = len(MAGIC) + HEADER.size + info_length
+    if os.path.getsize(path_to_file) != offset + no_of_datacells * dtype.itemsize:
+        raise ValueError(path_to_file + ": size doesn't match its " + str(no_of_datacells) + " datacells")
+    if verify:
+        sha = hashlib.sha256(info_bytes)
+        with open(path_to_file, "rb") as _:
+            _.seek(offset)
+            for chunk in iter(lambda: _.read(1 << 20), b""):
+                sha.update(chunk)
+        if sha.digest() != digest:
+            raise ValueError(path_to_file + ": content hash mismatch, the plan is damaged")
+    records = np.memmap(path_to_file, dtype=dtype, mode="r", offset=offset, shape=(no_of_datacells,)) if no_of_datacells else np.empty(0, dtype=dtype)
+    return {"info": info, "hash": digest.encode("hex"), "no_of_datacells": no_of_datacells, "records": records}
+
+def plan_arrays(plan, start=0, end=None):
+    "the fields of the datacells [start, end) of the plan as dict of arrays (memory-mapped views)"
+    records = plan["records"][start:end]
+    return dict((name, records[name]) for name in records.dtype.names)
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+append-only binary journal of the raw result messages as they came off the socket
+
+the file starts with MAGIC, followed by one record per message:
+a RECORD_HEADER (payload length, crc32 of the payload, receive time) and the payload,
+the message bytes exactly as received (plain json or codec.py encoded, single or batch).
+a record cut off or damaged by a crash ends the journal, opening it for appending drops it.
+
+the consumer writes it with journal=..., flush-queue.py with journal=... (drain mode),
+consumer.py replay_from=... rebuilds grids and statistics from it
+"""
+
+import os
+import struct
+import zlib
+
+MAGIC = b"YSJOURNAL1\n"
+RECORD_HEADER = struct.Struct("<IId")
+
+def _crc(payload):
+    return zlib.crc32(payload) & 0xffffffff
+
+def _records(_):
+    "(receive time, payload, offset after the record) of the valid records of the open journal"
+    while True:
+        header = _.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        length, crc, receive_time = RECORD_HEADER.unpack(header)
+        payload = _.read(length)
+        if len(payload) < length or _crc(payload) != crc:
+            return
+        yield receive_time, payload, _.tell()
+
+def read_journal(path_to_file):
+    "yield (receive time, message bytes) of all complete records"
+    with open(path_to_file, "rb") as _:
+        if _.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path_to_file + " is not a result journal")
+        for receive_time, payload, _offset in _records(_):
+            yield receive_time, payload
+
+def valid_size(path_to_file):
+    "size of the journal up to the end of the last complete record"
+    with open(path_to_file, "rb") as _:
+        if _.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path_to_file + " is not a result journal")
+        size = len(MAGIC)
+        for _time, _payload, offset in _records(_):
+            size = offset
+    return size
+
+class JournalWriter(object):
+    "append messages to a journal, an existing one is continued"
+
+    def __init__(self, path_to_file, buffer_size=1 << 20):
+        self.path_to_file = path_to_file
+        self.no_of_records = 0
+        path_to_dir = os.path.dirname(path_to_file)
+        if path_to_dir and not os.path.isdir(path_to_dir):
+            os.makedirs(path_to_dir)
+        if os.path.exists(path_to_file) and os.path.getsize(path_to_file) > 0:
+            size = valid_size(path_to_file)
+            if size < os.path.getsize(path_to_file):
+                with open(path_to_file, "r+b") as _:
+                    _.truncate(size)
+            self.file = open(path_to_file, "ab", buffer_size)
+        else:
+            self.file = open(path_to_file, "wb", buffer_size)
+            self.file.write(MAGIC)
+
+    def append(self, data, receive_time):
+        self.file.write(RECORD_HEADER.pack(len(data), _crc(data), receive_time))
+        self.file.write(data)
+        self.no_of_records += 1
+
+    def flush(self, sync=False):
+        "write the buffered records to the os, with sync=True to the disk"
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file:
+            self.flush(sync=True)
+            self.file.close()
+            self.file = None
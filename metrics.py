@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+throughput, latency and progress of producer and consumer, logged every interval seconds
+instead of a line per message and optionally exported to a file (.prom = prometheus text format, else json)
+"""
+
+import os
+import time
+import json
+from collections import OrderedDict, deque
+
+import numpy as np
+
+def latency_summary(latencies):
+    "mean, median, 95th percentile and max of the latencies (seconds) in ms"
+    if not len(latencies):
+        return {}
+    ms = np.array(latencies) * 1000.0
+    return OrderedDict([
+        ("mean", round(float(ms.mean()), 1)),
+        ("p50", round(float(np.percentile(ms, 50)), 1)),
+        ("p95", round(float(np.percentile(ms, 95)), 1)),
+        ("max", round(float(ms.max()), 1))
+    ])
+
+class Metrics(object):
+    "counters with overall and interval rates, latencies of the last max_latencies messages and progress/eta"
+
+    def __init__(self, name, interval=10.0, path_to_export_file=None, max_latencies=10000):
+        self.name = name
+        self.interval = interval
+        self.path_to_export_file = path_to_export_file
+        self.start_time = time.time()
+        self.last_log_time = self.start_time
+        self.counters = OrderedDict()
+        self.gauges = OrderedDict()
+        self.last_counters = {}
+        self.latencies = deque(maxlen=max_latencies)
+        self.done = None
+        self.total = None
+
+    def inc(self, counter, count=1):
+        self.counters[counter] = self.counters.get(counter, 0) + count
+
+    def set_gauge(self, gauge, value):
+        self.gauges[gauge] = value
+
+    def observe_latency(self, seconds):
+        self.latencies.append(seconds)
+
+    def set_progress(self, done, total):
+        "done of total units (e.g. datacells), for the eta"
+        self.done = done
+        self.total = total
+
+    def snapshot(self):
+        "all metrics as dict"
+        now = time.time()
+        elapsed = now - self.start_time
+        since_last_log = max(now - self.last_log_time, 1e-9)
+        snapshot = OrderedDict([("name", self.name), ("time", round(now, 3)), ("elapsed_s", round(elapsed, 3))])
+        snapshot["counters"] = OrderedDict(self.counters)
+        snapshot["rates_per_s"] = OrderedDict([(counter, round(value / max(elapsed, 1e-9), 1)) for counter, value in self.counters.iteritems()])
+        snapshot["interval_rates_per_s"] = OrderedDict([
+            (counter, round((value - self.last_counters.get(counter, 0)) / since_last_log, 1)) for counter, value in self.counters.iteritems()])
+        snapshot["gauges"] = OrderedDict(self.gauges)
+        snapshot["latency_ms"] = latency_summary(self.latencies)
+        if self.total:
+            snapshot["done"] = self.done
+            snapshot["total"] = self.total
+            eta = None
+            if self.done and elapsed > 0:
+                eta = round((self.total - self.done) / (self.done / elapsed), 1)
+            snapshot["eta_s"] = eta
+        return snapshot
+
+    def log(self):
+        "print one line and write the export file"
+        snapshot = self.snapshot()
+        parts = [self.name + ":"]
+        for counter, value in snapshot["counters"].iteritems():
+            parts.append(counter + "=" + str(value) + " (" + str(snapshot["interval_rates_per_s"][counter]) + "/s)")
+        for gauge, value in snapshot["gauges"].iteritems():
+            parts.append(gauge + "=" + str(value))
+        if snapshot["latency_ms"]:
+            parts.append("latency_ms=" + json.dumps(snapshot["latency_ms"]))
+        if "total" in snapshot:
+            parts.append("done=" + str(snapshot["done"]) + "/" + str(snapshot["total"]))
+            parts.append("eta_s=" + str(snapshot["eta_s"]))
+        print(" ".join(parts))
+        if self.path_to_export_file:
+            self.export(snapshot)
+        self.last_log_time = time.time()
+        self.last_counters = dict(self.counters)
+
+    def tick(self):
+        "log if the interval is over"
+        if time.time() - self.last_log_time >= self.interval:
+            self.log()
+
+    def export(self, snapshot):
+        "replace the export file with the snapshot"
+        tmp_path = self.path_to_export_file + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_path, "w") as _:
+            if self.path_to_export_file.endswith(".prom"):
+                _.write(prometheus_text(snapshot))
+            else:
+                json.dump(snapshot, _, indent=2)
+        os.rename(tmp_path, self.path_to_export_file)
+
+def prometheus_text(snapshot):
+    "the snapshot in prometheus text exposition format"
+    prefix = "yieldstat_" + snapshot["name"].replace(" ", "_").replace("-", "_") + "_"
+    lines = []
+    for counter, value in snapshot["counters"].iteritems():
+        lines.append("# TYPE " + prefix + counter + "_total counter")
+        lines.append(prefix + counter + "_total " + str(value))
+    for gauge, value in snapshot["gauges"].iteritems():
+        lines.append("# TYPE " + prefix + gauge + " gauge")
+        lines.append(prefix + gauge + " " + str(value))
+    lines.append("# TYPE " + prefix + "elapsed_seconds gauge")
+    lines.append(prefix + "elapsed_seconds " + str(snapshot["elapsed_s"]))
+    if snapshot["latency_ms"]:
+        lines.append("# TYPE " + prefix + "latency_milliseconds gauge")
+        for stat, value in snapshot["latency_ms"].iteritems():
+            lines.append(prefix + "latency_milliseconds{stat=\"" + stat + "\"} " + str(value))
+    if "total" in snapshot:
+        lines.append("# TYPE " + prefix + "done gauge")
+        lines.append(prefix + "done " + str(snapshot["done"]))
+        lines.append("# TYPE " + prefix + "total gauge")
+        lines.append(prefix + "total " + str(snapshot["total"]))
+        if snapshot["eta_s"] is not None:
+            lines.append("# TYPE " + prefix + "eta_seconds gauge")
+            lines.append(prefix + "eta_seconds " + str(snapshot["eta_s"]))
+    return "\n".join(lines) + "\n"
@@ -23,9 +23,12 @@ import csv
 import copy
 from StringIO import StringIO
 from datetime import date, datetime, timedelta
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import types
 import sys
+import shutil
+import tempfile
+import multiprocessing
 #print sys.path
 import zmq
 #print "pyzmq version: ", zmq.pyzmq_version(), " zmq version: ", zmq.zmq_version()
@@ -33,8 +36,17 @@ import re
 
 import sqlite3
 import numpy as np
-from scipy.interpolate import NearestNDInterpolator
-from pyproj import Proj, transform
+
+import ascii_grid
+import checkpoint
+import climate_locator
+import codec
+import completion
+import flow_control
+import job_plan
+import metrics
+import profiling
+import result_store
 
 LOCAL_PRODUCER = True
 #LOCAL_YIELDSTAT = True
@@ -50,13 +62,503 @@ PATHS = {
     }
 }
 
-def run_producer(server = {"server": None, "port": None}, shared_id = None):
-    "main"
+MMK_TYPES = [
+    ("hft", int), ("nft", int), ("sft", int), ("steino", int), ("slope", int),
+    ("stt", int), ("dgm", int), ("az", int), ("klz", int)
+]
+
+def has_same_geometry(meta, other_meta):
+    "true if both esri ascii grid headers describe the same raster"
+    return all(meta[key] == other_meta[key] for key in ["nrows", "ncols", "cellsize", "xllcorner", "yllcorner"])
+
+def select_datacells(ref_grid, ref_metadata, start_row=0, end_row=-1):
+    "row and col indices of all non-nodata cells of the reference grid in the row range [start_row, end_row]"
+    nrows = ref_grid.shape[0]
+    last_row = nrows - 1 if end_row < 0 else min(end_row, nrows - 1)
+    rows, cols = np.nonzero(ref_grid[start_row:last_row + 1] != int(ref_metadata["nodata_value"]))
+    return rows + start_row, cols
+
+def gk5_cell_centers(rows, cols, metadata):
+    "gk5 (r, h) center coordinates of the given cells of a grid"
+    cellsize = int(metadata["cellsize"])
+    r_gk5 = int(metadata["xllcorner"]) + cellsize // 2 + cols * cellsize
+    h_gk5 = int(metadata["yllcorner"]) + cellsize // 2 + (int(metadata["nrows"]) - rows - 1) * cellsize
+    return r_gk5, h_gk5
+
+def sample_layer(grid, metadata, ref_metadata, rows, cols, r_gk5, h_gk5):
+    """
+    sample a grid at the given reference cells,
+    cells of a grid sharing the reference geometry are read directly,
+    only the remaining cells (other geometry or nodata in this layer) are looked up by nearest neighbour
+    """
+    if has_same_geometry(metadata, ref_metadata):
+        values = grid[rows, cols]
+        missing = values == metadata["nodata_value"]
+        if not missing.any():
+            return values
+        interpolate = ascii_grid.create_ascii_grid_interpolator(grid, metadata)
+        values = values.copy()
+        values[missing] = interpolate(r_gk5[missing], h_gk5[missing])
+        return values
+
+    interpolate = ascii_grid.create_ascii_grid_interpolator(grid, metadata)
+    return interpolate(r_gk5, h_gk5)
+
+def sample_cells(gk5_grids, ref_metadata, rows, cols, climate_gk5_locator):
+    """
+    sample all mmk layers and the climate locator at once for the given reference cells,
+    returns a dict of mmk_type -> values array plus "crow" and "ccol" arrays
+    """
+    samples = {}
+    if len(rows) == 0:
+        for key in [mmk_type for mmk_type, _ in MMK_TYPES] + ["crow", "ccol"]:
+            samples[key] = np.array([], dtype=int)
+        return samples
+
+    r_gk5, h_gk5 = gk5_cell_centers(rows, cols, ref_metadata)
+
+    for mmk_type, (grid, metadata) in gk5_grids.iteritems():
+        samples[mmk_type] = sample_layer(grid, metadata, ref_metadata, rows, cols, r_gk5, h_gk5)
+
+    samples["crow"], samples["ccol"] = climate_gk5_locator.locate(r_gk5, h_gk5)
+    return samples
+
+# the sampled values which make up a cell's env, everything else is the same for all cells of a run
+SIMULATION_KEYS = [mmk_type for mmk_type, _ in MMK_TYPES] + ["crow", "ccol"]
+
+def group_identical_cells(samples, keys=SIMULATION_KEYS):
+    """
+    group the indices of cells with identical sampled values,
+    groups are ordered by their first cell and keep the row-major cell order inside
+    """
+    table = np.column_stack([np.asarray(samples[key]) for key in keys])
+    if len(table) == 0:
+        return []
+    _, first_indices, inverse = np.unique(table, axis=0, return_index=True, return_inverse=True)
+    cells_by_group = np.argsort(inverse, kind="mergesort")
+    groups = np.split(cells_by_group, np.cumsum(np.bincount(inverse))[:-1])
+    return [groups[group] for group in np.argsort(first_indices)]
+
+def env_layout(no_of_datacells, groups=None):
+    """
+    the datacells of every env as flat env_cells array and env_offsets array,
+    the cells of env i are env_cells[env_offsets[i]:env_offsets[i+1]]
+    """
+    if groups is None:
+        return np.arange(no_of_datacells), np.arange(no_of_datacells + 1)
+    env_cells = np.concatenate(groups) if groups else np.array([], dtype=int)
+    env_offsets = np.concatenate([[0], np.cumsum([len(group) for group in groups])])
+    return env_cells, env_offsets
+
+def restrict_env_layout(env_cells, env_offsets, keep):
+    "the env layout with only the datacells where keep (indexed by datacell) is true, envs left without cells are dropped"
+    kept = keep[env_cells]
+    env_nos = np.repeat(np.arange(len(env_offsets) - 1), np.diff(env_offsets))
+    counts = np.bincount(env_nos[kept], minlength=len(env_offsets) - 1)
+    counts = counts[counts > 0]
+    return env_cells[kept], np.concatenate([[0], np.cumsum(counts)]).astype(int)
+
+def hilbert_index(rows, cols):
+    "position of the cells (rows, cols) along a hilbert curve covering the grid"
+    x = np.array(cols, dtype=np.int64)
+    y = np.array(rows, dtype=np.int64)
+    n = 1
+    while n <= max(x.max(), y.max()):
+        n *= 2
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n // 2
+    while s > 0:
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant, so the curve stays continuous
+        flip = (ry == 0) & (rx == 1)
+        x[flip] = n - 1 - x[flip]
+        y[flip] = n - 1 - y[flip]
+        swap = ry == 0
+        x[swap], y[swap] = y[swap], x[swap]
+        s //= 2
+    return d
+
+def dispatch_order(arrays, env_nos, order="rows"):
+    """
+    env_nos in the order to send them: rows = as they are (row-major), climate = grouped by climate cell (crow, ccol),
+    hilbert = along a hilbert curve over the grid, the latter two let consecutive envs share their climate file
+    """
+    env_nos = np.asarray(env_nos, dtype=int)
+    if order == "rows" or len(env_nos) == 0:
+        return env_nos
+    first_cells = arrays["env_cells"][arrays["env_offsets"][env_nos]]
+    if order == "climate":
+        return env_nos[np.lexsort((np.arange(len(env_nos)), arrays["ccol"][first_cells], arrays["crow"][first_cells]))]
+    if order == "hilbert":
+        return env_nos[np.argsort(hilbert_index(arrays["row"][first_cells], arrays["col"][first_cells]), kind="mergesort")]
+    raise ValueError("unknown order: " + order)
+
+def cell_indices(arrays, env_no):
+    "indices of the datacells the env_no-th env stands for"
+    return arrays["env_cells"][arrays["env_offsets"][env_no]:arrays["env_offsets"][env_no + 1]]
+
+def fill_env_template(env_template, arrays, env_no, path_to_yieldstat_climate_dir, list_cells=False):
+    "set the cell specific parts of env_template for the env_no-th env"
+    cells = cell_indices(arrays, env_no)
+    i = cells[0]
+    rrow = int(arrays["row"][i])
+    rcol = int(arrays["col"][i])
+    crow = int(arrays["crow"][i])
+    ccol = int(arrays["ccol"][i])
+
+    for mmk_type, _ in MMK_TYPES:
+        env_template[mmk_type] = arrays[mmk_type][i].item()
+
+    env_template["pathToClimateCSV"] = path_to_yieldstat_climate_dir + "dwd/csvs/germany/row-" + str(crow+1) + "/col-" + str(ccol+1) + ".csv"
+    #print env_template["pathToClimateCSV"]
+
+    env_template["customId"] = {
+        "row": rrow, "col": rcol,
+        "crow": crow, "ccol": ccol
+    }
+    if list_cells:
+        env_template["customId"]["cells"] = [[int(arrays["row"][j]), int(arrays["col"][j])] for j in cells]
+
+def save_arrays(path_to_dir, arrays):
+    "save a dict of numpy arrays as .npy files into a directory"
+    if not os.path.isdir(path_to_dir):
+        os.makedirs(path_to_dir)
+    for name, arr in arrays.iteritems():
+        np.save(os.path.join(path_to_dir, name + ".npy"), arr)
+
+def load_arrays(path_to_dir, mmap_mode="r"):
+    "load all .npy files of a directory, memory-mapped by default, so processes share the data"
+    arrays = {}
+    for filename in os.listdir(path_to_dir):
+        if filename.endswith(".npy"):
+            arrays[filename[:-4]] = np.load(os.path.join(path_to_dir, filename), mmap_mode=mmap_mode)
+    return arrays
+
+def grid_path(config, path_to_data_dir, mmk_type):
+    "path to the esri ascii grid of mmk_type of config's region"
+    return path_to_data_dir + config["region"] + "/" + mmk_type + "_" + config["region"] + "_100_gk5.asc"
+
+def read_region(config, path_to_data_dir, profiler=profiling.NO_PROFILER):
+    """
+    read the soil grids of config["region"] (via the binary grid cache if configured) and the climate locator,
+    returns (gk5_grids, gk5_ref_grid, ref_metadata, climate_gk5_locator)
+    """
+    gk5_ref_grid = None
+    ref_metadata = None
+    gk5_grids = {}
+    for mmk_type, dtype in MMK_TYPES:
+        path_to_grid = grid_path(config, path_to_data_dir, mmk_type)
+        with profiler.phase("read_grids"):
+            grid, metadata, _ = ascii_grid.read_grid(path_to_grid, dtype=dtype, path_to_cache_dir=config["cache_dir"])
+        print "read grid from:", path_to_grid
+        gk5_grids[mmk_type] = (grid, metadata)
+        if mmk_type == config["ref_mmk_type"]:
+            gk5_ref_grid = grid
+            ref_metadata = metadata
 
+    path_to_latlon_to_rowcol_file = path_to_data_dir + "climate/dwd/csvs/latlon_to_rowcol.json"
+    with profiler.phase("climate_locator"):
+        climate_gk5_locator = climate_locator.load_climate_locator(path_to_latlon_to_rowcol_file, config["cache_dir"])
+    print "loaded climate gk5 locator:", path_to_latlon_to_rowcol_file
+    return gk5_grids, gk5_ref_grid, ref_metadata, climate_gk5_locator
+
+def sample_window(windows, ref_metadata, rows, cols, r_gk5, h_gk5, halo_rows):
+    """
+    sample_layer on the window of a streamed grid (ascii_grid.GridWindows) covering the given reference cells
+    plus halo_rows rows above and below, nearest neighbours further away than the halo aren't seen,
+    while the window has no values at all for the cells to look up the halo is doubled, up to the whole grid
+    """
+    metadata = windows.metadata
+    nodata_value = metadata["nodata_value"]
+    same_geometry = has_same_geometry(metadata, ref_metadata)
+    if same_geometry:
+        layer_rows = rows
+    else:
+        top = metadata["yllcorner"] + metadata["nrows"] * metadata["cellsize"]
+        layer_rows = ((top - h_gk5) // metadata["cellsize"]).astype(int)
+    while True:
+        first_row = min(max(0, layer_rows.min() - halo_rows), windows.nrows - 1)
+        grid = windows.window(first_row, max(first_row + 1, layer_rows.max() + halo_rows + 1))
+        needs_neighbours = not same_geometry or (grid[rows - first_row, cols] == nodata_value).any()
+        if not needs_neighbours or (grid != nodata_value).any():
+            break
+        if len(grid) == windows.nrows:
+            raise ValueError(windows.path_to_ascii_grid_file + " has no data at all, the cells in rows " +
+                             str(rows.min()) + " - " + str(rows.max()) + " can't be sampled")
+        halo_rows = max(1, 2 * halo_rows)
+    window_metadata = ascii_grid.window_metadata(metadata, first_row, first_row + len(grid))
+    if same_geometry:
+        return sample_layer(grid, window_metadata, window_metadata, rows - first_row, cols, r_gk5, h_gk5)
+    return sample_layer(grid, window_metadata, ref_metadata, rows, cols, r_gk5, h_gk5)
+
+def region_tiles(config, path_to_data_dir, climate_gk5_locator, profiler=profiling.NO_PROFILER):
+    """
+    yield the sampled arrays (as prepare_region) of config's [start_row, end_row] tile by tile of tile_rows reference rows,
+    the grids are streamed, so only a tile plus tile_halo rows of every grid is in memory at a time
+    """
+    tile_rows = int(config["tile_rows"])
+    halo_rows = int(config["tile_halo"])
+    windows = OrderedDict((mmk_type, ascii_grid.GridWindows(grid_path(config, path_to_data_dir, mmk_type), dtype, path_to_cache_dir=config["cache_dir"]))
+                          for mmk_type, dtype in MMK_TYPES)
+    ref_windows = windows[config["ref_mmk_type"]]
+    ref_metadata = ref_windows.metadata
+    start_row = int(config["start_row"])
+    last_row = ref_windows.nrows - 1 if int(config["end_row"]) < 0 else min(int(config["end_row"]), ref_windows.nrows - 1)
+    try:
+        for tile_start in xrange(start_row, last_row + 1, tile_rows):
+            tile_end = min(tile_start + tile_rows, last_row + 1)
+            with profiler.phase("read_grids"):
+                # the halo is read along, so sampling the reference layer doesn't have to go back
+                first_row = max(0, tile_start - halo_rows)
+                window = ref_windows.window(first_row, tile_end + halo_rows)
+                rows, cols = np.nonzero(window[tile_start - first_row:tile_end - first_row] != int(ref_metadata["nodata_value"]))
+            rows += tile_start
+            if not len(rows):
+                continue
+            with profiler.phase("sample_cells"):
+                r_gk5, h_gk5 = gk5_cell_centers(rows, cols, ref_metadata)
+                arrays = {}
+                for mmk_type, mmk_windows in windows.iteritems():
+                    arrays[mmk_type] = sample_window(mmk_windows, ref_metadata, rows, cols, r_gk5, h_gk5, halo_rows)
+                arrays["crow"], arrays["ccol"] = climate_gk5_locator.locate(r_gk5, h_gk5)
+                arrays["row"] = rows
+                arrays["col"] = cols
+            yield arrays
+    finally:
+        for mmk_windows in windows.itervalues():
+            mmk_windows.close()
+
+def parse_crop(crop_string):
+    m = re.search(r"(\d{3,4})(p|n|c)(i?)", crop_string)
+    try:
+        return {
+            "type": "Yieldstat::Core::YSCrop",
+            "id": int(m.group(1)),
+            "tillageType": ("conserving" if m.group(2) == "c" else ("noTillage" if m.group(2) == "n" else "plough")),
+            "irrigate": True if m.group(3) == "i" else False    
+        }
+    except:
+        print "The crop string:", crop_string, "doesn't resemble a valid crop! It will be ignored."
+        return None
+
+def sweep_scenarios(config):
+    """
+    (scenario id, climate scenario, crop rotation) of all combinations of the ;-separated
+    climate_scenario and crop_rotation lists, the scenario id is "" for a single combination
+    """
+    combinations = [(climate_scenario, crop_rotation)
+                    for climate_scenario in config["climate_scenario"].split(";")
+                    for crop_rotation in config["crop_rotation"].split(";")]
+    if len(combinations) == 1:
+        return [("",) + combinations[0]]
+    return [(climate_scenario + "_" + crop_rotation.replace(",", "-"), climate_scenario, crop_rotation)
+            for climate_scenario, crop_rotation in combinations]
+
+def create_env_template(config):
+    "the parts of the env which are the same for all cells of a run"
+    env_template = {
+        "type": "Yieldstat::Core::Env",
+        "climateScenario": config["climate_scenario"],
+        "startYear": int(config["start_year"]),
+        "endYear": int(config["end_year"]),
+        "trendBaseYear": int(config["trend_base_year"]),
+        "useDevTrend": config["use_dev_trend"],
+        "useCO2Increase": config["use_co2_increase"],
+        "returnCornUnits": config["return_corn_units"],
+        "getDryYearWaterNeed": config["get_dry_year_water_need"]
+    }
+
+    # create crop rotation
+    env_template["cropRotation"] = map(parse_crop, config["crop_rotation"].split(","))
+
+    if config["shared_id"]:
+        env_template["sharedId"] = config["shared_id"]
+
+    env_template["csvViaHeaderOptions"] = {
+        "start-date": config["start_year"] + "-01-01",
+        "end-date": config["end_year"] + "-12-31",
+        "no-of-climate-file-header-lines": 2,
+        "csv-separator": ","#,
+        #"header-to-acd-names": {
+        #    "DE-date": "de-date",
+        #    "globrad": ["globrad", "/", 100]
+        #}
+    }
+    return env_template
+
+def with_last(items):
+    "yield (item, true if it is the last one) for all items of an iterable"
+    items = iter(items)
+    try:
+        previous = next(items)
+    except StopIteration:
+        return
+    for item in items:
+        yield previous, False
+        previous = item
+    yield previous, True
+
+def cells_to_send(arrays, env_nos):
+    "number of datacells the envs env_nos stand for"
+    return int(np.diff(arrays["env_offsets"])[np.asarray(env_nos, dtype=int)].sum()) if len(env_nos) else 0
+
+def send_envs(config, env_template, path_to_yieldstat_climate_dir, parts, no_of_datacells, run_id=None, shared_sent_cells=None, name="", profiler=profiling.NO_PROFILER, scenario=None, no_of_cells_to_send=None, plan_hash=None, gate=None, send_metrics=None):
+    """
+    send the envs of parts, (arrays, env_nos) pairs, over an own PUSH socket,
+    parts may be a generator (tiles), then no_of_cells_to_send has to be given for the progress,
+    the last env carries the number of datacells of the whole run, all envs the plan id if sent from a job plan,
+    shared_sent_cells (multiprocessing.Value) is the sent cell count of all shards and scenarios for flow control,
+    gate the run's flow_control.CreditGate (created here if flow control is on and none is given),
+    send_metrics the run's metrics.Metrics with the progress total of all scenarios (created here if none is given),
+    in a sweep scenario is (scenario id, number of scenarios) and every env is tagged with the scenario id
+    """
     context = zmq.Context()
     socket = context.socket(zmq.PUSH)
+    if config["send_hwm"]:
+        socket.setsockopt(zmq.SNDHWM, int(config["send_hwm"]))
+    socket.connect("tcp://" + config["server"] + ":" + str(config["port"]))
 
-    config = {
+    own_gate = gate is None and int(config["max_in_flight"]) > 0
+    if own_gate:
+        gate = flow_control.CreditGate(context, config["progress_server"], config["progress_port"], int(config["max_in_flight"]))
+    send_stats = {"cells": 0}
+    if no_of_cells_to_send is None:
+        no_of_cells_to_send = sum(cells_to_send(arrays, env_nos) for arrays, env_nos in parts)
+    if send_metrics is None:
+        send_metrics = metrics.Metrics((name.rstrip(": ").replace(" ", "_") or "producer"), float(config["metrics_interval"]), config["metrics_file"] or None)
+        send_metrics.set_progress(0, no_of_cells_to_send)
+    # the run's metrics count on from the previous scenarios
+    done_before = send_metrics.done
+    verbose = config["verbose"] == "true"
+
+    def sent_cells():
+        return shared_sent_cells.value if shared_sent_cells is not None else send_stats["cells"]
+
+    def send(msg, no_of_envs, no_of_cells):
+        "send no_of_envs envs for no_of_cells datacells, waiting for credit first if flow control is on"
+        if gate:
+            with profiler.phase("wait_for_credit"):
+                gate.wait_for_credit(sent_cells())
+        with profiler.phase("socket_send"):
+            codec.send(socket, msg, config["wire_format"], config["compression"])
+        send_stats["cells"] += no_of_cells
+        if shared_sent_cells is not None:
+            with shared_sent_cells.get_lock():
+                shared_sent_cells.value += no_of_cells
+        send_metrics.inc("envs", no_of_envs)
+        send_metrics.inc("cells", no_of_cells)
+        send_metrics.set_progress(done_before + send_stats["cells"], send_metrics.total)
+        if gate:
+            send_metrics.set_gauge("in_flight", gate.in_flight(sent_cells()))
+        send_metrics.tick()
+
+    list_cells = config["dedup"] == "true"
+    sent_env_count = 1
+    batch_size = int(config["batch_size"])
+    batch = []
+    batch_cells = 0
+    envs = ((arrays, env_no) for arrays, env_nos in parts for env_no in env_nos)
+    for (arrays, env_no), is_last_env in with_last(envs):
+        with profiler.phase("build_env"):
+            fill_env_template(env_template, arrays, env_no, path_to_yieldstat_climate_dir, list_cells)
+        no_of_cells = len(cell_indices(arrays, env_no))
+        if run_id:
+            env_template["customId"]["runId"] = run_id
+            env_template["customId"]["envHash"] = str(arrays["env_hashes"][env_no])
+        if scenario:
+            env_template["customId"]["scenario"] = scenario[0]
+        if plan_hash:
+            env_template["customId"]["planHash"] = job_plan.plan_id(plan_hash)
+        # the consumer measures the latency from here to the arrival of the result
+        env_template["customId"]["sendTime"] = round(time.time(), 3)
+
+        if is_last_env:
+            env_template["customId"]["ndatacells"] = no_of_datacells
+            if scenario:
+                env_template["customId"]["noOfScenarios"] = scenario[1]
+            print name + "attached no-of-datacells:", env_template["customId"]
+
+        if batch_size > 1:
+            # env_template is reused for the next env, the per cell values are all replaced, so a shallow copy suffices
+            batch.append(dict(env_template))
+            batch_cells += no_of_cells
+            if len(batch) == batch_size or is_last_env:
+                send(batch, len(batch), batch_cells)
+                if verbose:
+                    print(name + "sent batch of ", len(batch), " envs, last customId: ", env_template["customId"])
+                del batch[:]
+                batch_cells = 0
+        else:
+            send(env_template, 1, no_of_cells)
+            #print env_template
+            if verbose:
+                print(name + "sent env ", sent_env_count, " customId: ", env_template["customId"])
+        #exit()
+        sent_env_count += 1
+
+    send_metrics.log()
+    if own_gate:
+        gate.close()
+    socket.close()
+    context.term()
+    return sent_env_count - 1
+
+def send_finish(config, run_id, no_of_datacells, scenario=None):
+    """
+    send a result-less finish message for a run served completely from the result store,
+    the workers pass it on, so the consumer learns run_id and ndatacells without any result
+    """
+    custom_id = {"runId": run_id, "ndatacells": no_of_datacells}
+    if scenario:
+        custom_id["scenario"] = scenario[0]
+        custom_id["noOfScenarios"] = scenario[1]
+    context = zmq.Context()
+    socket = context.socket(zmq.PUSH)
+    socket.connect("tcp://" + config["server"] + ":" + str(config["port"]))
+    codec.send(socket, {"type": "finish", "customId": custom_id}, config["wire_format"], config["compression"])
+    socket.close()
+    context.term()
+
+def create_run_metrics(config, no_of_cells_to_send):
+    "the send metrics of a run, shared by all its scenarios, so the export and the eta cover the whole run"
+    run_metrics = metrics.Metrics("producer", float(config["metrics_interval"]), config["metrics_file"] or None)
+    run_metrics.set_progress(0, no_of_cells_to_send)
+    return run_metrics
+
+def create_run_gate(config):
+    """
+    the credit gate of a run, shared by all its scenarios like the consumer's received cell count,
+    None without flow control
+    """
+    if int(config["max_in_flight"]) <= 0:
+        return None
+    return flow_control.CreditGate(zmq.Context.instance(), config["progress_server"], config["progress_port"], int(config["max_in_flight"]))
+
+def send_shard(config, env_template, path_to_yieldstat_climate_dir, path_to_arrays, start, end, no_of_datacells, run_id, shared_sent_cells, shard_no, scenario=None, plan_hash=None):
+    """
+    process entry point of a shard: send the envs arrays["env_nos"][start:end] from the memory-mapped arrays
+    in the directory path_to_arrays or, if it is a job plan, one env each for its datacells [start, end)
+    """
+    if os.path.isdir(path_to_arrays):
+        arrays = load_arrays(path_to_arrays)
+        env_nos = arrays["env_nos"][start:end]
+    else:
+        arrays = job_plan.plan_arrays(job_plan.read_plan(path_to_arrays, verify=False), start, end)
+        arrays["env_cells"], arrays["env_offsets"] = env_layout(end - start)
+        env_nos = np.arange(end - start)
+    if config["metrics_file"]:
+        path, ext = os.path.splitext(config["metrics_file"])
+        # the shards of every scenario are new processes, each writes its own file
+        config = dict(config, metrics_file=path + "_shard" + str(shard_no) + ("_" + scenario[0] if scenario else "") + ext)
+    send_envs(config, env_template, path_to_yieldstat_climate_dir, [(arrays, env_nos)], no_of_datacells, run_id, shared_sent_cells, "shard " + str(shard_no) + ": ",
+              scenario=scenario, plan_hash=plan_hash)
+
+def create_config(server = {"server": None, "port": None}, shared_id = None):
+    "the default config of a producer run"
+
+    return {
         "user": "berg",
         "port": server["port"] if server["port"] else "6666",
         "server": server["server"] if server["server"] else "localhost",
@@ -67,15 +569,318 @@ def run_producer(server = {"server": None, "port": None}, shared_id = None):
         "end_row": "-1",
         "start_year": "1991",
         "end_year": "2012",
-        "crop_rotation": "1017pi,1013n", # "1017ci"
-        "climate_scenario": "A1B",
+        "crop_rotation": "1017pi,1013n", # "1017ci", several separated by ; = sweep over them (consumer: sweep=true)
+        "climate_scenario": "A1B", # several separated by ; = sweep over them
         "return_corn_units": False,
         "use_dev_trend": False,
         "trend_base_year": "2005",
         "use_co2_increase": True,
         "get_dry_year_water_need": False,
-        "debug_mode": False
+        "debug_mode": False,
+        "cache_dir": "cache/", # empty = don't cache parsed grids and the climate locator
+        "data_dir": "", # read the region and climate data from there instead of the user's data dir (e.g. benchmarks/synthetic_region.py)
+        "dedup": "false", # true = send cells with identical envs only once, listing all cells in customId["cells"]
+        "result_store": "", # path to sqlite result store, envs with stored results are not sent again
+        "run_id": "", # id under which the run is registered in the result store, generated if empty
+        "batch_size": "1", # > 1 = send that many envs per message as json array (workers must support batches)
+        "wire_format": "json", # json | msgpack, anything but uncompressed json needs workers supporting codec.py
+        "compression": "", # "" | zlib | lz4
+        "send_hwm": "", # high water mark of the PUSH socket, empty = zmq default
+        "max_in_flight": "0", # > 0 = hold back envs while that many cells are unanswered (needs the consumer's progress_port)
+        "progress_server": "localhost", # where the consumer publishes its progress
+        "progress_port": "7778",
+        "shards": "1", # > 1 = send from that many processes, each with an own PUSH socket
+        "order": "rows", # order of the envs: rows (row-major) | climate (grouped by climate cell) | hilbert (space-filling curve), see dispatch_order
+        "tile_rows": "0", # > 0 = stream the region in tiles of that many rows instead of reading whole grids, see send_tiled
+        "tile_halo": "5", # rows above and below a tile searched for nearest neighbours (nodata cells, grids of other geometry)
+        "write_plan": "", # write the job plan of the region's rows to this file and exit (see job_plan.py)
+        "plan": "", # send the datacells of this job plan instead of reading the grids
+        "resume_from": "", # consumer checkpoint_dir, send only the cells without a result in the checkpoint
+        "resend_from": "", # consumer's missing_cells.csv, send only the missing and failed cells listed there
+        "metrics_interval": "10", # seconds between metrics log lines (envs/s, cells/s, eta)
+        "metrics_file": "", # also write the metrics there, .prom = prometheus text format, else json
+        "verbose": "false", # true = print a line per sent message
+        "profile": "false", # true = time the run's phases incl. peak rss, cprofile = also dump a cProfile of the whole run
+        "profile_report": "" # path of the json profile report, default producer_profile.json
     }
+
+def data_paths(config, local_yieldstat=True):
+    "(path to the data dir, path to the climate dir as seen by yieldstat) of the config"
+    paths = PATHS[config["user"]]
+    path_to_data_dir = paths["local_path_to_data_dir"] if LOCAL_PRODUCER else paths["cluster_path_to_data_dir"]
+    path_to_yieldstat_climate_dir = paths["local_path_to_data_dir"] + "climate/" if local_yieldstat else paths["cluster_path_to_data_dir"] + "climate/"
+    if config["data_dir"]:
+        path_to_data_dir = config["data_dir"]
+        path_to_yieldstat_climate_dir = config["data_dir"] + "climate/"
+    return path_to_data_dir, path_to_yieldstat_climate_dir
+
+def prepare_region(config, path_to_data_dir, start_row=0, end_row=-1, profiler=profiling.NO_PROFILER):
+    """
+    read the region of config and sample all layers and the climate locator at its datacells in [start_row, end_row],
+    returns {"shape": reference grid shape, "metadata": reference grid header, "arrays": sampled values plus "row" and "col"},
+    the grids themselves aren't kept
+    """
+    gk5_grids, gk5_ref_grid, ref_metadata, climate_gk5_locator = read_region(config, path_to_data_dir, profiler)
+    with profiler.phase("sample_cells"):
+        rows, cols = select_datacells(gk5_ref_grid, ref_metadata, start_row, end_row)
+        arrays = sample_cells(gk5_grids, ref_metadata, rows, cols, climate_gk5_locator)
+        arrays["row"] = rows
+        arrays["col"] = cols
+    print "sampled", len(rows), "datacells"
+    return {"shape": gk5_ref_grid.shape, "metadata": ref_metadata, "arrays": arrays}
+
+def write_plan(config, path_to_data_dir, path_to_plan_file, profiler=profiling.NO_PROFILER):
+    """
+    sample the datacells of config's region in [start_row, end_row] (tile by tile if tile_rows > 0)
+    and write them as job plan, returns its content hash
+    """
+    ref_metadata, ref_header = ascii_grid.read_header(grid_path(config, path_to_data_dir, config["ref_mmk_type"]))
+    info = {
+        "region": config["region"], "ref_mmk_type": config["ref_mmk_type"],
+        "start_row": int(config["start_row"]), "end_row": int(config["end_row"]),
+        "metadata": ref_metadata, "header": ref_header
+    }
+    writer = job_plan.PlanWriter(path_to_plan_file, info, ["row", "col"] + SIMULATION_KEYS)
+    if int(config["tile_rows"]) > 0:
+        path_to_latlon_to_rowcol_file = path_to_data_dir + "climate/dwd/csvs/latlon_to_rowcol.json"
+        climate_gk5_locator = climate_locator.load_climate_locator(path_to_latlon_to_rowcol_file, config["cache_dir"])
+        for arrays in region_tiles(config, path_to_data_dir, climate_gk5_locator, profiler):
+            writer.append(arrays)
+    else:
+        writer.append(prepare_region(config, path_to_data_dir, int(config["start_row"]), int(config["end_row"]), profiler)["arrays"])
+    content_hash = writer.close()
+    print "wrote plan of", writer.no_of_datacells, "datacells to", path_to_plan_file, "- content hash:", content_hash
+    return content_hash
+
+def region_from_plan(config, path_to_plan_file):
+    "the region (as prepare_region) of a job plan, raises ValueError if it is damaged or of another region"
+    plan = job_plan.read_plan(path_to_plan_file)
+    info = plan["info"]
+    if info["region"] != config["region"] or info["ref_mmk_type"] != config["ref_mmk_type"]:
+        raise ValueError(path_to_plan_file + " is a plan of " + info["region"] + "/" + info["ref_mmk_type"] + ", not " + config["region"] + "/" + config["ref_mmk_type"])
+    print "read plan of", plan["no_of_datacells"], "datacells from", path_to_plan_file, "- content hash:", plan["hash"]
+    return {
+        "shape": (int(info["metadata"]["nrows"]), int(info["metadata"]["ncols"])), "metadata": info["metadata"],
+        "arrays": job_plan.plan_arrays(plan), "plan_file": path_to_plan_file, "plan_hash": plan["hash"]
+    }
+
+def send_job(config, region, path_to_yieldstat_climate_dir, profiler=profiling.NO_PROFILER):
+    """
+    send the envs of the datacells of the prepared region in config's [start_row, end_row]
+    (all scenarios of a sweep), returns the number of sent envs
+    """
+    env_template = create_env_template(config)
+
+    # the region's arrays are left untouched, they may be shared by several jobs
+    arrays = region["arrays"]
+    nrows = region["shape"][0]
+    start_row = int(config["start_row"])
+    last_row = nrows - 1 if int(config["end_row"]) < 0 else min(int(config["end_row"]), nrows - 1)
+    in_rows = (arrays["row"] >= start_row) & (arrays["row"] <= last_row)
+    if in_rows.all():
+        arrays = dict(arrays)
+    else:
+        arrays = dict((name, values[in_rows]) for name, values in arrays.iteritems())
+    rows = arrays["row"]
+    cols = arrays["col"]
+    no_of_datacells = len(rows)
+
+    groups = None
+    if config["dedup"] == "true":
+        with profiler.phase("dedup"):
+            groups = group_identical_cells(arrays)
+        print "deduplicated", no_of_datacells, "datacells to", len(groups), "envs"
+    arrays["env_cells"], arrays["env_offsets"] = env_layout(no_of_datacells, groups)
+    if config["resume_from"]:
+        received = checkpoint.load_received_bitmap(config["resume_from"])
+        if received is None:
+            print "no checkpoint in", config["resume_from"], "- sending all datacells"
+        else:
+            missing = ~received[rows, cols]
+            arrays["env_cells"], arrays["env_offsets"] = restrict_env_layout(arrays["env_cells"], arrays["env_offsets"], missing)
+            print "resuming from checkpoint", config["resume_from"], "-", int(missing.sum()), "of", no_of_datacells, "datacells missing"
+    if config["resend_from"]:
+        resend = np.zeros(region["shape"], dtype=bool)
+        resend[completion.read_report(config["resend_from"])] = True
+        listed = resend[rows, cols]
+        arrays["env_cells"], arrays["env_offsets"] = restrict_env_layout(arrays["env_cells"], arrays["env_offsets"], listed)
+        print "re-sending", int(listed.sum()), "of", no_of_datacells, "datacells listed in", config["resend_from"]
+    no_of_envs = len(arrays["env_offsets"]) - 1
+
+    # a sweep sends the envs of every scenario, the sampled region is shared by all of them
+    scenarios = sweep_scenarios(config)
+    if len(scenarios) > 1:
+        print "sweeping over", len(scenarios), "scenarios:", ", ".join(scenario_id for scenario_id, _, _ in scenarios)
+    sent_env_count = 0
+    base_run_id = config["run_id"] or config["region"] + "_" + datetime.now().strftime("%Y%m%d%H%M%S") + "_" + str(os.getpid())
+    # the cells sent in all scenarios so far, the consumer counts the received ones over the whole sweep too
+    shared_sent_cells = multiprocessing.Value("l", 0)
+    gate = create_run_gate(config)
+    run_metrics = create_run_metrics(config, len(scenarios) * cells_to_send(arrays, np.arange(no_of_envs)))
+    try:
+        for scenario_id, climate_scenario, crop_rotation in scenarios:
+            if scenario_id:
+                env_template = create_env_template(dict(config, climate_scenario=climate_scenario, crop_rotation=crop_rotation))
+            scenario = (scenario_id, len(scenarios)) if scenario_id else None
+
+            env_nos_to_send = np.arange(no_of_envs)
+            run_id = None
+            if config["result_store"]:
+                # skip all envs whose results are already in the store and tell the consumer about them via the store
+                run_id = base_run_id + ("_" + scenario_id if scenario_id else "")
+                env_hashes = []
+                with profiler.phase("env_hashes"):
+                    for env_no in xrange(no_of_envs):
+                        fill_env_template(env_template, arrays, env_no, path_to_yieldstat_climate_dir)
+                        env_hashes.append(result_store.env_hash(env_template))
+                arrays["env_hashes"] = np.array(env_hashes)
+
+                store = result_store.ResultStore(config["result_store"])
+                stored_hashes = store.contains(set(env_hashes))
+                env_nos_to_send = []
+                cached_cells = []
+                for env_no, env_hash in enumerate(env_hashes):
+                    if env_hash in stored_hashes:
+                        cached_cells.extend((int(rows[i]), int(cols[i]), env_hash) for i in cell_indices(arrays, env_no))
+                    else:
+                        env_nos_to_send.append(env_no)
+                env_nos_to_send = np.array(env_nos_to_send, dtype=int)
+                store.register_run(run_id, no_of_datacells, cached_cells)
+                store.close()
+                print "run_id:", run_id, "-", len(cached_cells), "of", no_of_datacells, "datacells served from result store", config["result_store"]
+                run_metrics.set_progress(run_metrics.done, run_metrics.total - cells_to_send(arrays, np.arange(no_of_envs)) + cells_to_send(arrays, env_nos_to_send))
+                if not len(env_nos_to_send):
+                    send_finish(config, run_id, no_of_datacells, scenario)
+                    print "nothing to send, told the consumer to collect run_id:", run_id, "from the result store"
+                    continue
+
+            env_nos_to_send = dispatch_order(arrays, env_nos_to_send, config["order"])
+
+            no_of_shards = min(int(config["shards"]), len(env_nos_to_send))
+            if no_of_shards > 1:
+                # the shards get the preprocessed arrays memory-mapped and agree on the global datacell count,
+                # sending every datacell of a plan in its order they just cut the plan itself by index range,
+                # unless the envs carry env hashes for the result store, the plan doesn't have them
+                from_plan = ("plan_file" in region and not run_id and in_rows.all()
+                             and np.array_equal(env_nos_to_send, np.arange(no_of_datacells)) and no_of_envs == no_of_datacells)
+                if from_plan:
+                    path_to_arrays_dir = region["plan_file"]
+                else:
+                    arrays["env_nos"] = env_nos_to_send
+                    path_to_arrays_dir = tempfile.mkdtemp(prefix="producer_shards_")
+                    save_arrays(path_to_arrays_dir, arrays)
+                bounds = np.linspace(0, len(env_nos_to_send), no_of_shards + 1).astype(int)
+                processes = []
+                for shard_no in range(no_of_shards):
+                    process = multiprocessing.Process(target=send_shard, args=(
+                        config, env_template, path_to_yieldstat_climate_dir, path_to_arrays_dir,
+                        bounds[shard_no], bounds[shard_no + 1], no_of_datacells, run_id, shared_sent_cells, shard_no, scenario, region.get("plan_hash")))
+                    process.start()
+                    processes.append(process)
+                with profiler.phase("send_shards"):
+                    for process in processes:
+                        process.join()
+                if not from_plan:
+                    shutil.rmtree(path_to_arrays_dir, ignore_errors=True)
+                failed_shards = [str(shard_no) for shard_no, process in enumerate(processes) if process.exitcode != 0]
+                if failed_shards:
+                    raise RuntimeError("shard(s) " + ", ".join(failed_shards) + " of " + str(no_of_shards) + " failed (see their output above), not all envs were sent")
+                sent_env_count += len(env_nos_to_send)
+            else:
+                with profiler.phase("send"):
+                    sent_env_count += send_envs(config, env_template, path_to_yieldstat_climate_dir, [(arrays, env_nos_to_send)], no_of_datacells, run_id,
+                                                shared_sent_cells, name=(scenario_id + ": " if scenario_id else ""), profiler=profiler, scenario=scenario,
+                                                plan_hash=region.get("plan_hash"), gate=gate, send_metrics=run_metrics)
+    finally:
+        if gate:
+            gate.close()
+
+    return sent_env_count
+
+def send_tiled(config, path_to_data_dir, path_to_yieldstat_climate_dir, profiler=profiling.NO_PROFILER):
+    """
+    send the envs of config's [start_row, end_row] tile by tile (see region_tiles) without ever holding whole grids,
+    dedup, order, resume_from and resend_from work within each tile, result_store needs the whole region and
+    isn't supported, shards aren't either, returns the number of sent envs
+    """
+    if config["result_store"]:
+        raise ValueError("result_store needs the whole region, it can't be used with tile_rows")
+    if int(config["shards"]) > 1:
+        print "tile_rows: sending from one process, shards are ignored"
+
+    # a first pass over the reference grid only, the last env has to carry the datacells of the whole run
+    ref_windows = ascii_grid.GridWindows(grid_path(config, path_to_data_dir, config["ref_mmk_type"]), path_to_cache_dir=config["cache_dir"])
+    nodata_value = int(ref_windows.metadata["nodata_value"])
+    start_row = int(config["start_row"])
+    last_row = ref_windows.nrows - 1 if int(config["end_row"]) < 0 else min(int(config["end_row"]), ref_windows.nrows - 1)
+
+    keep = None
+    if config["resume_from"]:
+        received = checkpoint.load_received_bitmap(config["resume_from"])
+        if received is None:
+            print "no checkpoint in", config["resume_from"], "- sending all datacells"
+        else:
+            keep = ~received
+    if config["resend_from"]:
+        resend = np.zeros((ref_windows.nrows, ref_windows.ncols), dtype=bool)
+        resend[completion.read_report(config["resend_from"])] = True
+        keep = resend if keep is None else keep & resend
+
+    no_of_datacells = 0
+    no_of_cells_to_send = 0
+    tile_rows = int(config["tile_rows"])
+    with profiler.phase("count_datacells"):
+        for tile_start in xrange(start_row, last_row + 1, tile_rows):
+            tile_end = min(tile_start + tile_rows, last_row + 1)
+            datacells = ref_windows.window(tile_start, tile_end) != nodata_value
+            no_of_datacells += int(datacells.sum())
+            no_of_cells_to_send += int((datacells & keep[tile_start:tile_end]).sum()) if keep is not None else int(datacells.sum())
+    ref_windows.close()
+    print "streaming", no_of_datacells, "datacells in tiles of", tile_rows, "rows,", no_of_cells_to_send, "to send"
+
+    path_to_latlon_to_rowcol_file = path_to_data_dir + "climate/dwd/csvs/latlon_to_rowcol.json"
+    with profiler.phase("climate_locator"):
+        climate_gk5_locator = climate_locator.load_climate_locator(path_to_latlon_to_rowcol_file, config["cache_dir"])
+    print "loaded climate gk5 locator:", path_to_latlon_to_rowcol_file
+
+    def tile_envs():
+        "(arrays, env_nos to send) of every tile"
+        for arrays in region_tiles(config, path_to_data_dir, climate_gk5_locator, profiler):
+            groups = None
+            if config["dedup"] == "true":
+                with profiler.phase("dedup"):
+                    groups = group_identical_cells(arrays)
+            arrays["env_cells"], arrays["env_offsets"] = env_layout(len(arrays["row"]), groups)
+            if keep is not None:
+                arrays["env_cells"], arrays["env_offsets"] = restrict_env_layout(arrays["env_cells"], arrays["env_offsets"], keep[arrays["row"], arrays["col"]])
+            yield arrays, dispatch_order(arrays, np.arange(len(arrays["env_offsets"]) - 1), config["order"])
+
+    scenarios = sweep_scenarios(config)
+    if len(scenarios) > 1:
+        print "sweeping over", len(scenarios), "scenarios:", ", ".join(scenario_id for scenario_id, _, _ in scenarios)
+    sent_env_count = 0
+    # as in send_job, flow control counts the cells sent over all scenarios
+    shared_sent_cells = multiprocessing.Value("l", 0)
+    gate = create_run_gate(config)
+    run_metrics = create_run_metrics(config, len(scenarios) * no_of_cells_to_send)
+    try:
+        for scenario_id, climate_scenario, crop_rotation in scenarios:
+            # every scenario streams the grids again, nothing of the region is kept between them
+            env_template = create_env_template(dict(config, climate_scenario=climate_scenario, crop_rotation=crop_rotation))
+            scenario = (scenario_id, len(scenarios)) if scenario_id else None
+            with profiler.phase("send"):
+                sent_env_count += send_envs(config, env_template, path_to_yieldstat_climate_dir, tile_envs(), no_of_datacells, None,
+                                            shared_sent_cells, name=(scenario_id + ": " if scenario_id else ""), profiler=profiler, scenario=scenario,
+                                            no_of_cells_to_send=no_of_cells_to_send, gate=gate, send_metrics=run_metrics)
+    finally:
+        if gate:
+            gate.close()
+    return sent_env_count
+
+def run_producer(server = {"server": None, "port": None}, shared_id = None):
+    "main"
+
+    config = create_config(server, shared_id)
     LOCAL_YIELDSTAT = True
     # read commandline args only if script is invoked directly from commandline
     if len(sys.argv) > 1 and __name__ == "__main__":
@@ -88,216 +893,38 @@ def run_producer(server = {"server": None, "port": None}, shared_id = None):
 
     print "config:", config
 
-    paths = PATHS[config["user"]]
-    path_to_data_dir = paths["local_path_to_data_dir"] if LOCAL_PRODUCER else paths["cluster_path_to_data_dir"]
-    path_to_yieldstat_climate_dir = paths["local_path_to_data_dir"] + "climate/" if LOCAL_YIELDSTAT else paths["cluster_path_to_data_dir"] + "climate/"
-    
-    socket.connect("tcp://" + config["server"] + ":" + str(config["port"]))
+    path_to_data_dir, path_to_yieldstat_climate_dir = data_paths(config, LOCAL_YIELDSTAT)
 
-    def read_header(path_to_ascii_grid_file):
-        "read metadata from esri ascii grid file"
-        metadata = {}
-        header_str = ""
-        with open(path_to_ascii_grid_file) as _:
-            for i in range(0, 6):
-                line = _.readline()
-                header_str += line
-                sline = [x for x in line.split() if len(x) > 0]
-                if len(sline) > 1:
-                    metadata[sline[0].strip().lower()] = float(sline[1].strip())
-        return metadata, header_str
-
-    wgs84 = Proj(init="epsg:4326")
-    #gk3 = Proj(init="epsg:3396")
-    gk5 = Proj(init="epsg:31469")
-
-    def create_ascii_grid_interpolator(arr, meta, ignore_nodata=True):
-        "create interpolator from numpy array"
-
-        rows, cols = arr.shape
-
-        cellsize = int(meta["cellsize"])
-        xll = int(meta["xllcorner"])
-        yll = int(meta["yllcorner"])
-        nodata_value = meta["nodata_value"]
-
-        xll_center = xll + cellsize // 2
-        yll_center = yll + cellsize // 2
-        yul_center = yll_center + (rows - 1)*cellsize
-
-        points = []
-        values = []
-
-        for row in range(rows):
-            for col in range(cols):
-                value = arr[row, col]
-                if ignore_nodata and value == nodata_value:
-                    continue
-                r = xll_center + col * cellsize
-                h = yul_center - row * cellsize
-                points.append([r, h])
-                values.append(value)
-
-        return NearestNDInterpolator(np.array(points), np.array(values))
-
-    def read_file_and_create_interpolator(path_to_grid, dtype=int, skiprows=6, confirm_creation=False):
-        "read file and metadata and create interpolator"
-
-        metadata, _ = read_header(path_to_grid)
-        grid = np.loadtxt(path_to_grid, dtype=dtype, skiprows=skiprows)
-        interpolate = create_ascii_grid_interpolator(grid, metadata)
-        if confirm_creation: 
-            print "created interpolator from:", path_to_grid
-        return (interpolate, grid, metadata)
-    
-    gk5_ref_grid = None
-    ref_metadata = None
-    gk5_interpolators = {}
-    gk5_grids = {}
-    for mmk_type, dtype in [
-        ("hft", int), ("nft", int), ("sft", int), ("steino", int), ("slope", int),
-        ("stt", int), ("dgm", int), ("az", int), ("klz", int)
-    ]:
-        path_to_grid = path_to_data_dir + config["region"] + "/" + mmk_type + "_" + config["region"] + "_100_gk5.asc"
-        inter, grid, metadata = read_file_and_create_interpolator(path_to_grid, confirm_creation=True)
-        gk5_interpolators[mmk_type] = inter
-        if mmk_type == config["ref_mmk_type"]:
-            gk5_ref_grid = grid
-            ref_metadata = metadata
+    profiler = profiling.Profiler("producer", config["profile"], config["profile_report"])
 
-    cdict = {}
-    def create_climate_gk5_interpolator_from_json_file(path_to_latlon_to_rowcol_file, wgs84, gk5):
-        "create interpolator from json list of lat/lon to row/col mappings"
-        with open(path_to_latlon_to_rowcol_file) as _:
-            points = []
-            values = []
-
-            for latlon, rowcol in json.load(_):
-                row, col = rowcol
-                clat, clon = latlon
-                try:
-                    cr_gk5, ch_gk5 = transform(wgs84, gk5, clon, clat)
-                    cdict[(row, col)] = (round(clat, 4), round(clon, 4))
-                    points.append([cr_gk5, ch_gk5])
-                    values.append((row, col))
-                    #print "row:", row, "col:", col, "clat:", clat, "clon:", clon, "h:", h, "r:", r, "val:", values[i]
-                except:
-                    continue
+    if config["write_plan"]:
+        write_plan(config, path_to_data_dir, config["write_plan"], profiler)
+        profiler.write_report()
+        return
 
-            return NearestNDInterpolator(np.array(points), np.array(values))
+    if config["plan"]:
+        with profiler.phase("read_plan"):
+            region = region_from_plan(config, config["plan"])
 
-    climate_gk5_interpolator = create_climate_gk5_interpolator_from_json_file(path_to_data_dir + "climate/dwd/csvs/latlon_to_rowcol.json", wgs84, gk5)
-    print "created climate gk5 interpolator:", path_to_data_dir + "climate/dwd/csvs/latlon_to_rowcol.json"
+        start_time = time.clock()
 
-    sent_env_count = 1
-    start_time = time.clock()
+        sent_env_count = send_job(config, region, path_to_yieldstat_climate_dir, profiler)
+    elif int(config["tile_rows"]) > 0:
+        start_time = time.clock()
+        sent_env_count = send_tiled(config, path_to_data_dir, path_to_yieldstat_climate_dir, profiler)
+    else:
+        region = prepare_region(config, path_to_data_dir, int(config["start_row"]), int(config["end_row"]), profiler)
 
-    env_template = {
-        "type": "Yieldstat::Core::Env",
-        "climateScenario": config["climate_scenario"],
-        "startYear": int(config["start_year"]),
-        "endYear": int(config["end_year"]),
-        "trendBaseYear": int(config["trend_base_year"]),
-        "useDevTrend": config["use_dev_trend"],
-        "useCO2Increase": config["use_co2_increase"],
-        "returnCornUnits": config["return_corn_units"],
-        "getDryYearWaterNeed": config["get_dry_year_water_need"]
-    }
-
-    def parse_crop(crop_string):
-        m = re.search(r"(\d{3,4})(p|n|c)(i?)", crop_string)
-        try:
-            return {
-                "type": "Yieldstat::Core::YSCrop",
-                "id": int(m.group(1)),
-                "tillageType": ("conserving" if m.group(2) == "c" else ("noTillage" if m.group(2) == "n" else "plough")),
-                "irrigate": True if m.group(3) == "i" else False    
-            }
-        except:
-            print "The crop string:", crop_string, "doesn't resemble a valid crop! It will be ignored."
-            return None
-
-    # create crop rotation
-    env_template["cropRotation"] = map(parse_crop, config["crop_rotation"].split(","))
-
-    if config["shared_id"]:
-        env_template["sharedId"] = config["shared_id"]
-
-    rcols = int(ref_metadata["ncols"])
-    rrows = int(ref_metadata["nrows"])
-    rcellsize = int(ref_metadata["cellsize"])
-    xllcorner = int(ref_metadata["xllcorner"])
-    yllcorner = int(ref_metadata["yllcorner"])
-
-    no_of_datacells = 0
-    for rrow in xrange(0, rrows):
-        #print rrow,
-
-        if rrow < int(config["start_row"]):
-            continue
-        elif int(config["end_row"]) >= 0 and rrow > int(config["end_row"]):
-            break
-
-        for rcol in xrange(0, rcols):
-
-            stt = gk5_ref_grid[rrow, rcol]
-            if stt == -9999:
-                continue
-            
-            #get coordinate of clostest climate element of real soil-cell
-            rh_gk5 = yllcorner + (rcellsize / 2) + (rrows - rrow - 1) * rcellsize
-            rr_gk5 = xllcorner + (rcellsize / 2) + rcol * rcellsize
-
-            crow, ccol = climate_gk5_interpolator(rr_gk5, rh_gk5)
-
-            env_template["dgm"] = gk5_interpolators["dgm"](rr_gk5, rh_gk5)
-            env_template["hft"] = gk5_interpolators["hft"](rr_gk5, rh_gk5)
-            env_template["nft"] = gk5_interpolators["nft"](rr_gk5, rh_gk5)
-            env_template["sft"] = gk5_interpolators["sft"](rr_gk5, rh_gk5)
-            env_template["slope"] = gk5_interpolators["slope"](rr_gk5, rh_gk5)
-            env_template["steino"] = gk5_interpolators["steino"](rr_gk5, rh_gk5)
-            env_template["az"] = gk5_interpolators["az"](rr_gk5, rh_gk5)
-            env_template["klz"] = gk5_interpolators["klz"](rr_gk5, rh_gk5)
-            env_template["stt"] = gk5_interpolators["stt"](rr_gk5, rh_gk5)
-
-            env_template["csvViaHeaderOptions"] = {
-                "start-date": config["start_year"] + "-01-01",
-		        "end-date": config["end_year"] + "-12-31",
-        		"no-of-climate-file-header-lines": 2,
-		        "csv-separator": ","#,
-		        #"header-to-acd-names": {
-			    #    "DE-date": "de-date",
-			    #    "globrad": ["globrad", "/", 100]
-		        #}
-            }
-
-            env_template["pathToClimateCSV"] = path_to_yieldstat_climate_dir + "dwd/csvs/germany/row-" + str(crow+1) + "/col-" + str(ccol+1) + ".csv"
-            #print env_template["pathToClimateCSV"]
-
-            no_of_datacells += 1
-
-            env_template["customId"] = {
-                "row": rrow, "col": rcol,
-                "crow": crow, "ccol": ccol
-            }
-
-            is_last_row = rrow == rrows-1 or rrow == int(config["end_row"])
-            if is_last_row and rcol == rcols-1:
-                env_template["customId"]["ndatacells"] = no_of_datacells
-                print "attached no-of-datacells:", env_template["customId"]
-
-            socket.send_json(env_template)
-            #print env_template
-            print("sent env ", sent_env_count, " customId: ", env_template["customId"])
-            #exit()
-            sent_env_count += 1
+        start_time = time.clock()
 
+        sent_env_count = send_job(config, region, path_to_yieldstat_climate_dir, profiler)
 
     stop_time = time.clock()
 
-    print "sending ", (sent_env_count-1), " envs took ", (stop_time - start_time), " seconds"
+    print "sending ", sent_env_count, " envs took ", (stop_time - start_time), " seconds"
     #print "ran from ", start, "/", row_cols[start], " to ", end, "/", row_cols[end]
+    profiler.write_report()
     print "exiting run_producer()"
 
 if __name__ == "__main__":
-    run_producer()
\ No newline at end of file
+    run_producer()
@@ -16,27 +16,15 @@
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
 import time
-import os
-import math
 import json
-import csv
-import copy
-from StringIO import StringIO
-from datetime import date, datetime, timedelta
-from collections import defaultdict
-import types
 import sys
-#print sys.path
+from collections import deque
+
 import zmq
-#print "pyzmq version: ", zmq.pyzmq_version(), " zmq version: ", zmq.zmq_version()
-import re
 import capnp
-climate_data_capnp = capnp.load("/mnt/c/Users/berg.ZALF-AD/GitHub/climate_data_capnp_access/climate_data.capnp")
 
-import sqlite3
-import numpy as np
-from scipy.interpolate import NearestNDInterpolator
-from pyproj import Proj, transform
+import metrics
+import producer
 
 LOCAL_PRODUCER = True
 LOCAL_YIELDSTAT = True
@@ -52,16 +40,51 @@ PATHS = {
     }
 }
 
+def run_pipelined(run_yieldstat, envs, window, on_result, result_field="resultString", run_metrics=None):
+    """
+    send the (customId, env) pairs to the RunYieldstat capability with up to window requests in flight,
+    on_result(customId, result string) is called for every response in send order,
+    results, latency and in flight requests go to run_metrics (metrics.Metrics) like producer's and consumer's,
+    returns the per request latencies (send until the response arrived) in seconds
+    """
+    in_flight = deque()
+    latencies = []
+    run_metrics = run_metrics or metrics.Metrics("producer_capnp")
+
+    def complete_oldest():
+        send_time, custom_id, promise = in_flight.popleft()
+        # waiting on a promise also runs the callbacks of all others which arrived meanwhile, so arrival_time is exact
+        arrival_time, response = promise.wait()
+        latencies.append(arrival_time - send_time)
+        on_result(custom_id, getattr(response, result_field))
+        run_metrics.inc("results")
+        run_metrics.observe_latency(arrival_time - send_time)
+        run_metrics.set_gauge("in_flight", len(in_flight))
+        if run_metrics.total:
+            run_metrics.set_progress(len(latencies), run_metrics.total)
+        run_metrics.tick()
+
+    for custom_id, env in envs:
+        if len(in_flight) >= window:
+            complete_oldest()
+        request = run_yieldstat.run_request()
+        request.envString = json.dumps(env)
+        promise = request.send().then(lambda response: (time.time(), response))
+        in_flight.append((time.time(), custom_id, promise))
+
+    while in_flight:
+        complete_oldest()
+
+    run_metrics.log()
+    return latencies
+
 def run_producer(server = {"server": None, "port": None}, shared_id = None):
     "main"
 
-    context = zmq.Context()
-    socket = context.socket(zmq.PUSH)
-
     config = {
         "user": "berg",
-        "port": server["port"] if server["port"] else "6666",
-        "server": server["server"] if server["server"] else "localhost",
+        "port": server["port"] if server["port"] else "7777",
+        "server": server["server"] if server["server"] else "10.10.26.34:6666",
         "shared_id": shared_id,
         "region": "quillow", #"ddr",
         "ref_mmk_type": "stt",
@@ -76,7 +99,14 @@ def run_producer(server = {"server": None, "port": None}, shared_id = None):
         "trend_base_year": "2005",
         "use_co2_increase": True,
         "get_dry_year_water_need": False,
-        "debug_mode": False
+        "debug_mode": False,
+        "cache_dir": "cache/", # empty = don't cache parsed grids and the climate locator
+        "capnp_schema": "/mnt/c/Users/berg.ZALF-AD/GitHub/climate_data_capnp_access/climate_data.capnp",
+        "result_field": "resultString", # field of the run response holding the result json
+        "window": "16", # number of requests in flight, 1 = wait for every result before sending the next env
+        "metrics_interval": "10", # seconds between metrics log lines (results/s, latency, in flight, eta)
+        "metrics_file": "", # also write the metrics there, .prom = prometheus text format, else json
+        "stats_file": "" # write throughput and latency summary as json there
     }
     # read commandline args only if script is invoked directly from commandline
     if len(sys.argv) > 1 and __name__ == "__main__":
@@ -84,233 +114,66 @@ def run_producer(server = {"server": None, "port": None}, shared_id = None):
             k, v = arg.split("=")
             if k in config:
                 config[k] = v
-                if k == "server" and v.startswith("cluster") :
-                    LOCAL_YIELDSTAT = False
 
     print "config:", config
 
     paths = PATHS[config["user"]]
     path_to_data_dir = paths["local_path_to_data_dir"] if LOCAL_PRODUCER else paths["cluster_path_to_data_dir"]
     path_to_yieldstat_climate_dir = paths["local_path_to_data_dir"] + "climate/" if LOCAL_YIELDSTAT else paths["cluster_path_to_data_dir"] + "climate/"
-    
-    socket.connect("tcp://" + config["server"] + ":" + str(config["port"]))
-
-    def read_header(path_to_ascii_grid_file):
-        "read metadata from esri ascii grid file"
-        metadata = {}
-        header_str = ""
-        with open(path_to_ascii_grid_file) as _:
-            for i in range(0, 6):
-                line = _.readline()
-                header_str += line
-                sline = [x for x in line.split() if len(x) > 0]
-                if len(sline) > 1:
-                    metadata[sline[0].strip().lower()] = float(sline[1].strip())
-        return metadata, header_str
-
-    wgs84 = Proj(init="epsg:4326")
-    #gk3 = Proj(init="epsg:3396")
-    gk5 = Proj(init="epsg:31469")
-
-    def create_ascii_grid_interpolator(arr, meta, ignore_nodata=True):
-        "create interpolator from numpy array"
-
-        rows, cols = arr.shape
-
-        cellsize = int(meta["cellsize"])
-        xll = int(meta["xllcorner"])
-        yll = int(meta["yllcorner"])
-        nodata_value = meta["nodata_value"]
-
-        xll_center = xll + cellsize // 2
-        yll_center = yll + cellsize // 2
-        yul_center = yll_center + (rows - 1)*cellsize
-
-        points = []
-        values = []
-
-        for row in range(rows):
-            for col in range(cols):
-                value = arr[row, col]
-                if ignore_nodata and value == nodata_value:
-                    continue
-                r = xll_center + col * cellsize
-                h = yul_center - row * cellsize
-                points.append([r, h])
-                values.append(value)
-
-        return NearestNDInterpolator(np.array(points), np.array(values))
-
-    def read_file_and_create_interpolator(path_to_grid, dtype=int, skiprows=6, confirm_creation=False):
-        "read file and metadata and create interpolator"
-
-        metadata, _ = read_header(path_to_grid)
-        grid = np.loadtxt(path_to_grid, dtype=dtype, skiprows=skiprows)
-        interpolate = create_ascii_grid_interpolator(grid, metadata)
-        if confirm_creation: 
-            print "created interpolator from:", path_to_grid
-        return (interpolate, grid, metadata)
-    
-    gk5_ref_grid = None
-    ref_metadata = None
-    gk5_interpolators = {}
-    gk5_grids = {}
-    for mmk_type, dtype in [
-        #("hft", int), ("nft", int), ("sft", int), ("steino", int), ("slope", int),
-        #("stt", int), ("dgm", int), ("az", int), ("klz", int)
-    ]:
-        path_to_grid = path_to_data_dir + config["region"] + "/" + mmk_type + "_" + config["region"] + "_100_gk5.asc"
-        inter, grid, metadata = read_file_and_create_interpolator(path_to_grid, confirm_creation=True)
-        gk5_interpolators[mmk_type] = inter
-        if mmk_type == config["ref_mmk_type"]:
-            gk5_ref_grid = grid
-            ref_metadata = metadata
-
-    cdict = {}
-    def create_climate_gk5_interpolator_from_json_file(path_to_latlon_to_rowcol_file, wgs84, gk5):
-        "create interpolator from json list of lat/lon to row/col mappings"
-        with open(path_to_latlon_to_rowcol_file) as _:
-            points = []
-            values = []
-
-            for latlon, rowcol in json.load(_):
-                row, col = rowcol
-                clat, clon = latlon
-                try:
-                    cr_gk5, ch_gk5 = transform(wgs84, gk5, clon, clat)
-                    cdict[(row, col)] = (round(clat, 4), round(clon, 4))
-                    points.append([cr_gk5, ch_gk5])
-                    values.append((row, col))
-                    #print "row:", row, "col:", col, "clat:", clat, "clon:", clon, "h:", h, "r:", r, "val:", values[i]
-                except:
-                    continue
-
-            return NearestNDInterpolator(np.array(points), np.array(values))
-
-    climate_gk5_interpolator = None #create_climate_gk5_interpolator_from_json_file(path_to_data_dir + "climate/dwd/csvs/latlon_to_rowcol.json", wgs84, gk5)
-    print "created climate gk5 interpolator:", path_to_data_dir + "climate/dwd/csvs/latlon_to_rowcol.json"
-
-    sent_env_count = 1
-    start_time = time.clock()
-
-    env_template = {
-        "type": "Yieldstat::Core::Env",
-        "climateScenario": config["climate_scenario"],
-        "startYear": int(config["start_year"]),
-        "endYear": int(config["end_year"]),
-        "trendBaseYear": int(config["trend_base_year"]),
-        "useDevTrend": config["use_dev_trend"],
-        "useCO2Increase": config["use_co2_increase"],
-        "returnCornUnits": config["return_corn_units"],
-        "getDryYearWaterNeed": config["get_dry_year_water_need"]
-    }
-
-    def parse_crop(crop_string):
-        m = re.search(r"(\d{3,4})(p|n|c)(i?)", crop_string)
-        try:
-            return {
-                "type": "Yieldstat::Core::YSCrop",
-                "id": int(m.group(1)),
-                "tillageType": ("conserving" if m.group(2) == "c" else ("noTillage" if m.group(2) == "n" else "plough")),
-                "irrigate": True if m.group(3) == "i" else False    
-            }
-        except:
-            print "The crop string:", crop_string, "doesn't resemble a valid crop! It will be ignored."
-            return None
-
-    # create crop rotation
-    env_template["cropRotation"] = map(parse_crop, config["crop_rotation"].split(","))
-
-    if config["shared_id"]:
-        env_template["sharedId"] = config["shared_id"]
-
-    rcols = int(ref_metadata["ncols"])
-    rrows = int(ref_metadata["nrows"])
-    rcellsize = int(ref_metadata["cellsize"])
-    xllcorner = int(ref_metadata["xllcorner"])
-    yllcorner = int(ref_metadata["yllcorner"])
-
-    capnp_client = capnp.TwoPartyClient("10.10.26.34:6666")
-    print capnp_client
-    run_yieldstat = client.ez_restore("").cast_as(climate_data_capnp.RunYieldstat)
-    print run_yieldstat
-
-    no_of_datacells = 0
-    for rrow in xrange(0, rrows):
-        #print rrow,
-
-        if rrow < int(config["start_row"]):
-            continue
-        elif int(config["end_row"]) >= 0 and rrow > int(config["end_row"]):
-            break
-
-        for rcol in xrange(0, rcols):
-
-            stt = gk5_ref_grid[rrow, rcol]
-            if stt == -9999:
-                continue
-            
-            #get coordinate of clostest climate element of real soil-cell
-            rh_gk5 = yllcorner + (rcellsize / 2) + (rrows - rrow - 1) * rcellsize
-            rr_gk5 = xllcorner + (rcellsize / 2) + rcol * rcellsize
-
-            crow, ccol = climate_gk5_interpolator(rr_gk5, rh_gk5)
 
-            env_template["dgm"] = gk5_interpolators["dgm"](rr_gk5, rh_gk5)
-            env_template["hft"] = gk5_interpolators["hft"](rr_gk5, rh_gk5)
-            env_template["nft"] = gk5_interpolators["nft"](rr_gk5, rh_gk5)
-            env_template["sft"] = gk5_interpolators["sft"](rr_gk5, rh_gk5)
-            env_template["slope"] = gk5_interpolators["slope"](rr_gk5, rh_gk5)
-            env_template["steino"] = gk5_interpolators["steino"](rr_gk5, rh_gk5)
-            env_template["az"] = gk5_interpolators["az"](rr_gk5, rh_gk5)
-            env_template["klz"] = gk5_interpolators["klz"](rr_gk5, rh_gk5)
-            env_template["stt"] = gk5_interpolators["stt"](rr_gk5, rh_gk5)
-
-            env_template["csvViaHeaderOptions"] = {
-                "start-date": config["start_year"] + "-01-01",
-		        "end-date": config["end_year"] + "-12-31",
-        		"no-of-climate-file-header-lines": 2,
-		        "csv-separator": ","#,
-		        #"header-to-acd-names": {
-			    #    "DE-date": "de-date",
-			    #    "globrad": ["globrad", "/", 100]
-		        #}
-            }
-
-            env_template["pathToClimateCSV"] = path_to_yieldstat_climate_dir + "dwd/csvs/germany/row-" + str(crow+1) + "/col-" + str(ccol+1) + ".csv"
-            #print env_template["pathToClimateCSV"]
-
-            no_of_datacells += 1
-
-            env_template["customId"] = {
-                "row": rrow, "col": rcol,
-                "crow": crow, "ccol": ccol
-            }
-
-            is_last_row = rrow == rrows-1 or rrow == int(config["end_row"])
-            if is_last_row and rcol == rcols-1:
+    gk5_grids, gk5_ref_grid, ref_metadata, climate_gk5_locator = producer.read_region(config, path_to_data_dir)
+    env_template = producer.create_env_template(config)
+
+    rows, cols = producer.select_datacells(gk5_ref_grid, ref_metadata, int(config["start_row"]), int(config["end_row"]))
+    no_of_datacells = len(rows)
+    arrays = producer.sample_cells(gk5_grids, ref_metadata, rows, cols, climate_gk5_locator)
+    arrays["row"] = rows
+    arrays["col"] = cols
+    arrays["env_cells"], arrays["env_offsets"] = producer.env_layout(no_of_datacells)
+    print "sampled", no_of_datacells, "datacells"
+
+    def envs():
+        "(customId, env) of all datacells, the last one carries the number of datacells"
+        for env_no in xrange(no_of_datacells):
+            producer.fill_env_template(env_template, arrays, env_no, path_to_yieldstat_climate_dir)
+            if env_no == no_of_datacells - 1:
                 env_template["customId"]["ndatacells"] = no_of_datacells
                 print "attached no-of-datacells:", env_template["customId"]
+            yield env_template["customId"], env_template
 
-            env_str = json.dumps(env_template)
-            request = run_yieldstat.run_request()
-            request.envString = env_str
-            run_promise = request.send()
-            result = run_promise.wait()
-            print result
-
-            #socket.send_json(env_template)
-            #print env_template
-            print("sent env ", sent_env_count, " customId: ", env_template["customId"])
-            #exit()
-            sent_env_count += 1
-
-
-    stop_time = time.clock()
+    # the results go to the consumer like a worker's would, the consumer connects to this PUSH socket
+    context = zmq.Context()
+    socket = context.socket(zmq.PUSH)
+    socket.bind("tcp://*:" + str(config["port"]))
+
+    def forward_result(custom_id, result_str):
+        socket.send(result_str)
+
+    climate_data_capnp = capnp.load(config["capnp_schema"])
+    capnp_client = capnp.TwoPartyClient(config["server"])
+    run_yieldstat = capnp_client.bootstrap().cast_as(climate_data_capnp.RunYieldstat)
+
+    run_metrics = metrics.Metrics("producer_capnp", float(config["metrics_interval"]), config["metrics_file"] or None)
+    run_metrics.set_progress(0, no_of_datacells)
+    start_time = time.time()
+    latencies = run_pipelined(run_yieldstat, envs(), max(1, int(config["window"])), forward_result, config["result_field"], run_metrics)
+    seconds = time.time() - start_time
+
+    stats = {
+        "envs": len(latencies),
+        "seconds": round(seconds, 3),
+        "envs_per_second": round(len(latencies) / seconds, 1) if seconds > 0 else None,
+        "window": int(config["window"]),
+        "latency_ms": metrics.latency_summary(latencies)
+    }
+    print "sent and received", stats["envs"], "envs in", stats["seconds"], "s,", stats["envs_per_second"], "envs/s, latency ms:", stats["latency_ms"]
+    if config["stats_file"]:
+        with open(config["stats_file"], "w") as _:
+            json.dump(stats, _, indent=2)
 
-    print "sending ", (sent_env_count-1), " envs took ", (stop_time - start_time), " seconds"
-    #print "ran from ", start, "/", row_cols[start], " to ", end, "/", row_cols[end]
+    socket.close()
+    context.term()
     print "exiting run_producer()"
 
 if __name__ == "__main__":
-    run_producer()
\ No newline at end of file
+    run_producer()
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+long-lived producer: keeps the sampled layers of regions in memory and sends the envs of job requests
+
+    python producer_service.py preload=quillow server=localhost port=6666
+    python producer_service.py mode=submit region=quillow start_row=0 end_row=99 crop_rotation=1017ci
+    python producer_service.py mode=status
+    python producer_service.py mode=evict region=quillow
+    python producer_service.py mode=stop
+
+a request is a json object on the ROUTER socket (REQ or DEALER clients) with "type" job (default),
+status, evict or stop. a job request holds producer config keys (region, start_row, end_row, start_year,
+end_year, crop_rotation, climate_scenario, ...) overriding the service's config. the service replies as
+soon as the region is ready and then streams the envs, requests arriving meanwhile are answered after
+the job. regions are evicted least recently used first when there are more than max_regions or their
+estimated size exceeds max_memory_mb
+"""
+
+import os
+import sys
+import json
+import time
+from datetime import datetime
+from collections import OrderedDict
+
+import zmq
+
+import producer
+import profiling
+
+# config keys of the service, everything else is a producer config key
+SERVICE_KEYS = ["mode", "service_server", "service_port", "max_regions", "max_memory_mb", "preload"]
+
+def region_size_mb(region):
+    "estimated memory of a prepared region"
+    return sum(values.nbytes for values in region["arrays"].itervalues()) / 1024.0 / 1024.0
+
+class RegionCache(object):
+    "prepared regions by (data dir, region, reference mmk type), least recently used ones are evicted first"
+
+    def __init__(self, max_regions, max_memory_mb):
+        self.max_regions = max_regions
+        self.max_memory_mb = max_memory_mb
+        self.regions = OrderedDict()
+
+    def get(self, key, load):
+        "the region for key, load() prepares it if it isn't cached, returns (region, true if it was cached)"
+        if key in self.regions:
+            region = self.regions.pop(key)
+            self.regions[key] = region
+            return region, True
+        region = load()
+        self.regions[key] = region
+        self.evict(keep=key)
+        return region, False
+
+    def size_mb(self):
+        return sum(region_size_mb(region) for region in self.regions.itervalues())
+
+    def evict(self, keep=None):
+        "evict the least recently used regions until the limits hold again, but never keep"
+        while len(self.regions) > 1 and (len(self.regions) > self.max_regions or self.size_mb() > self.max_memory_mb):
+            key = next(iter(self.regions))
+            if key == keep:
+                break
+            del self.regions[key]
+            print "evicted region:", key
+
+    def remove(self, region_name):
+        "evict all cached variants of the region, returns their number"
+        keys = [key for key in self.regions if key[1] == region_name]
+        for key in keys:
+            del self.regions[key]
+        return len(keys)
+
+    def status(self):
+        return [OrderedDict([
+            ("data_dir", key[0]), ("region", key[1]), ("ref_mmk_type", key[2]),
+            ("datacells", len(region["arrays"]["row"])), ("size_mb", round(region_size_mb(region), 1))
+        ]) for key, region in self.regions.iteritems()]
+
+def job_config(service_config, request, job_no):
+    "the producer config of a job request, raises ValueError on unknown keys"
+    unknown = [key for key in request if key != "type" and (key not in service_config or key in SERVICE_KEYS)]
+    if unknown:
+        raise ValueError("unknown config keys: " + ", ".join(unknown))
+    config = dict((key, value) for key, value in service_config.iteritems() if key not in SERVICE_KEYS)
+    for key, value in request.iteritems():
+        if key != "type":
+            config[key] = value if isinstance(value, (str, unicode, bool)) or value is None else str(value)
+    if config["result_store"] and not config["run_id"]:
+        # several jobs a second mustn't share a run_id
+        config["run_id"] = config["region"] + "_" + datetime.now().strftime("%Y%m%d%H%M%S") + "_" + str(os.getpid()) + "_" + str(job_no)
+    return config
+
+def serve(config):
+    "answer requests until a stop request arrives"
+    context = zmq.Context()
+    socket = context.socket(zmq.ROUTER)
+    socket.bind("tcp://*:" + config["service_port"])
+
+    cache = RegionCache(int(config["max_regions"]), float(config["max_memory_mb"]))
+    local_yieldstat = not config["server"].startswith("cluster")
+    jobs = []
+
+    def region_of(job):
+        "the cached or freshly prepared region of the job config"
+        if job["plan"]:
+            # a job plan stands in for the data dir, its records stay memory-mapped
+            return cache.get((job["plan"], job["region"], job["ref_mmk_type"]), lambda: producer.region_from_plan(job, job["plan"]))
+        path_to_data_dir, _ = producer.data_paths(job, local_yieldstat)
+        key = (path_to_data_dir, job["region"], job["ref_mmk_type"])
+        # the whole region, jobs select their rows
+        return cache.get(key, lambda: producer.prepare_region(job, path_to_data_dir))
+
+    for region_name in [name for name in config["preload"].split(",") if name]:
+        region_of(dict(config, region=region_name))
+    print "producer service listening on port", config["service_port"]
+
+    stop = False
+    while not stop:
+        frames = socket.recv_multipart()
+        payload = frames[-1]
+
+        def reply(msg):
+            # same envelope as the request (identity and the empty delimiter of REQ clients)
+            socket.send_multipart(frames[:-1] + [json.dumps(msg)])
+
+        job = None
+        try:
+            request = json.loads(payload)
+            request_type = request.get("type", "job")
+            if request_type == "status":
+                reply(OrderedDict([
+                    ("status", "ok"), ("regions", cache.status()), ("regions_size_mb", round(cache.size_mb(), 1)),
+                    ("rss_mb", profiling.current_rss_mb()), ("jobs", jobs[-20:])
+                ]))
+            elif request_type == "evict":
+                reply({"status": "ok", "evicted": cache.remove(request["region"])})
+            elif request_type == "stop":
+                reply({"status": "ok"})
+                stop = True
+            elif request_type == "job":
+                job_no = len(jobs) + 1
+                job = job_config(config, request, job_no)
+                start_time = time.time()
+                region, cached = region_of(job)
+                reply(OrderedDict([
+                    ("status", "accepted"), ("job", job_no), ("region", job["region"]), ("cached", cached),
+                    ("prepare_seconds", round(time.time() - start_time, 3)), ("run_id", job["run_id"] or None)
+                ]))
+            else:
+                raise ValueError("unknown request type: " + str(request_type))
+        except Exception as e:
+            print "request failed:", e
+            reply({"status": "error", "error": str(e)})
+            continue
+
+        if job:
+            print "job", job_no, "- region:", job["region"], "rows:", job["start_row"], "-", job["end_row"], "scenario:", job["climate_scenario"], job["crop_rotation"]
+            _, path_to_yieldstat_climate_dir = producer.data_paths(job, local_yieldstat)
+            start_time = time.time()
+            try:
+                sent_env_count = producer.send_job(job, region, path_to_yieldstat_climate_dir)
+                jobs.append(OrderedDict([("job", job_no), ("region", job["region"]), ("envs", sent_env_count), ("seconds", round(time.time() - start_time, 3))]))
+            except Exception as e:
+                print "job", job_no, "failed:", e
+                jobs.append(OrderedDict([("job", job_no), ("region", job["region"]), ("error", str(e))]))
+
+    socket.close()
+    context.term()
+
+def request(config, msg):
+    "send a request to the service and return the reply"
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
+    socket.connect("tcp://" + config["service_server"] + ":" + config["service_port"])
+    socket.send(json.dumps(msg))
+    reply = json.loads(socket.recv())
+    socket.close()
+    context.term()
+    return reply
+
+def main():
+    "run the service or send it a request"
+
+    config = producer.create_config()
+    config.update({
+        "mode": "serve", # serve | submit (a job with the other given keys) | status | evict (region=...) | stop
+        "service_server": "localhost", # where submit, status and stop find the service
+        "service_port": "6665", # of the ROUTER socket accepting requests
+        "max_regions": "4", # regions kept in memory
+        "max_memory_mb": "2000", # estimated size of the regions kept in memory
+        "preload": "" # comma separated regions prepared at start
+    })
+    given = {}
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+                given[k] = v
+
+    if config["mode"] == "serve":
+        print "config:", config
+        serve(config)
+    else:
+        msg = {"type": "job" if config["mode"] == "submit" else config["mode"]}
+        if config["mode"] in ["submit", "evict"]:
+            msg.update((k, v) for k, v in given.iteritems() if k not in SERVICE_KEYS)
+        print json.dumps(request(config, msg), indent=2)
+
+if __name__ == "__main__":
+    main()
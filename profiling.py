@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+optional phase profiling of producer and consumer runs (profile=true or profile=cprofile)
+
+a phase sums wall and cpu time over all its calls, so per message phases (receive, decode, ...)
+can be timed in the loops, and records the process' peak and current rss after its last call.
+the report is a json file, with profile=cprofile the whole run is also dumped for pstats/snakeviz
+"""
+
+import os
+import time
+import json
+import resource
+import cProfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+def peak_rss_mb():
+    "peak resident set size of the process so far"
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+def current_rss_mb():
+    "current resident set size of the process, None where /proc isn't available"
+    try:
+        with open("/proc/self/statm") as _:
+            return round(int(_.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024.0 / 1024.0, 1)
+    except (IOError, OSError, ValueError):
+        return None
+
+def cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+class _NoPhase(object):
+    "the phase of a disabled profiler, cheap enough for per message phases"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NO_PHASE = _NoPhase()
+
+class Profiler(object):
+    "phase timers and rss of a run, does nothing unless enabled"
+
+    def __init__(self, name, mode="false", path_to_report=None):
+        self.name = name
+        self.enabled = mode in ["true", "cprofile"]
+        self.path_to_report = path_to_report or name + "_profile.json"
+        self.start_time = time.time()
+        self.phases = OrderedDict()
+        self.cprofile = None
+        if mode == "cprofile":
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def phase(self, name):
+        "context manager timing one call of phase name"
+        if not self.enabled:
+            return _NO_PHASE
+        return self._phase(name)
+
+    @contextmanager
+    def _phase(self, name):
+        start_time = time.time()
+        start_cpu = cpu_seconds()
+        try:
+            yield
+        finally:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = OrderedDict([("name", name), ("calls", 0), ("seconds", 0.0), ("cpu_seconds", 0.0)])
+            phase["calls"] += 1
+            phase["seconds"] += time.time() - start_time
+            phase["cpu_seconds"] += cpu_seconds() - start_cpu
+            phase["peak_rss_mb"] = peak_rss_mb()
+            phase["rss_mb"] = current_rss_mb()
+
+    def report(self):
+        "the profile as dict"
+        total_seconds = time.time() - self.start_time
+        phases = []
+        for phase in self.phases.itervalues():
+            phase = OrderedDict(phase)
+            phase["seconds"] = round(phase["seconds"], 4)
+            phase["cpu_seconds"] = round(phase["cpu_seconds"], 4)
+            phase["share"] = round(phase["seconds"] / total_seconds, 4) if total_seconds > 0 else None
+            phases.append(phase)
+        return OrderedDict([
+            ("name", self.name),
+            ("pid", os.getpid()),
+            ("total_seconds", round(total_seconds, 4)),
+            ("peak_rss_mb", peak_rss_mb()),
+            ("phases", phases)
+        ])
+
+    def write_report(self):
+        "write the json report (and the cProfile dump next to it), returns the report"
+        if not self.enabled:
+            return None
+        report = self.report()
+        with open(self.path_to_report, "w") as _:
+            json.dump(report, _, indent=2)
+        print("wrote profile report to: " + self.path_to_report)
+        if self.cprofile:
+            self.cprofile.disable()
+            path_to_dump = os.path.splitext(self.path_to_report)[0] + ".prof"
+            self.cprofile.dump_stats(path_to_dump)
+            print("wrote cProfile stats to: " + path_to_dump)
+        return report
+
+NO_PROFILER = Profiler("none")
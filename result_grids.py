@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import os
+import numpy as np
+
+class ResultGrids(object):
+    """
+    the consumer's result grids as one preallocated float32 cube (year, row, col) per result id,
+    the cubes are memory-mapped .npy files if path_to_dir is given, else they live in ram
+    """
+
+    def __init__(self, nrows, ncols, nodata_value, years, path_to_dir=None):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.nodata_value = nodata_value
+        self.years = [str(year) for year in years]
+        self.year_to_index = dict([(year, i) for i, year in enumerate(self.years)])
+        self.path_to_dir = path_to_dir
+        self.cubes = {}
+        # (year, res_id) combinations which got at least one value
+        self.written = set()
+        if path_to_dir and not os.path.isdir(path_to_dir):
+            os.makedirs(path_to_dir)
+
+    def _new_cube(self, res_id, no_of_years):
+        shape = (no_of_years, self.nrows, self.ncols)
+        if self.path_to_dir:
+            path = os.path.join(self.path_to_dir, res_id + "_" + str(no_of_years) + ".npy")
+            cube = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+            cube[:] = self.nodata_value
+            return cube
+        return np.full(shape, self.nodata_value, dtype=np.float32)
+
+    def _drop_cube(self, cube):
+        if isinstance(cube, np.memmap):
+            try:
+                os.remove(cube.filename)
+            except OSError:
+                pass
+
+    def _year_index(self, year):
+        "index of year in the cubes, years outside the configured range grow all cubes"
+        year = str(year)
+        if year not in self.year_to_index:
+            self.year_to_index[year] = len(self.years)
+            self.years.append(year)
+            for res_id, cube in self.cubes.items():
+                grown = self._new_cube(res_id, len(self.years))
+                grown[:len(cube)] = cube
+                self.cubes[res_id] = grown
+                self._drop_cube(cube)
+        return self.year_to_index[year]
+
+    def _cube(self, res_id):
+        if res_id not in self.cubes:
+            self.cubes[res_id] = self._new_cube(res_id, len(self.years))
+        return self.cubes[res_id]
+
+    def set(self, year, res_id, rows, cols, value):
+        "set value for the given cells"
+        year_index = self._year_index(year)
+        self._cube(res_id)[year_index, rows, cols] = value
+        self.written.add((str(year), res_id))
+
+    def grid(self, year, res_id):
+        return self.cubes[res_id][self.year_to_index[str(year)]]
+
+    def iteritems(self):
+        "(year, res_id, grid) of all grids with values, the grids are views into the cubes"
+        for year, res_id in sorted(self.written):
+            yield year, res_id, self.grid(year, res_id)
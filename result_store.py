@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+"""
+sqlite store of the results of whole envs, keyed by the content hash of the env (env_hash)
+
+known limitation: the key covers the complete env including startYear/endYear and cropRotation,
+so a run with a changed year range or another crop in the rotation hashes differently for every
+cell and misses the store completely, only reruns with otherwise identical envs (e.g. a region
+extended by rows, re-sent cells, a repeated sweep scenario) are served from it
+"""
+
+import json
+import hashlib
+import sqlite3
+
+# env keys which don't influence the simulation result
+NON_SIMULATION_ENV_KEYS = ["customId", "sharedId"]
+
+def env_hash(env):
+    "canonical content hash of an env, ignoring customId and sharedId"
+    content = dict([(k, v) for k, v in env.iteritems() if k not in NON_SIMULATION_ENV_KEYS])
+    return hashlib.sha1(json.dumps(content, sort_keys=True, separators=(",", ":"))).hexdigest()
+
+class ResultStore(object):
+    """
+    sqlite store of year2cropResult per env hash shared by producer and consumer,
+    also keeps for each producer run the cells which were served from the store instead of being sent
+    """
+
+    def __init__(self, path_to_db_file):
+        self.connection = sqlite3.connect(path_to_db_file, timeout=60)
+        self.connection.text_factory = str
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (env_hash TEXT PRIMARY KEY, year2crop_result TEXT NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, ndatacells INTEGER NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS run_cached_cells (run_id TEXT NOT NULL, row INTEGER NOT NULL, col INTEGER NOT NULL, env_hash TEXT NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS run_cached_cells_run_id ON run_cached_cells (run_id)")
+
+    def close(self):
+        self.connection.close()
+
+    def contains(self, env_hashes, chunk_size=500):
+        "the subset of the given env hashes which have a stored result"
+        env_hashes = list(env_hashes)
+        found = set()
+        for i in xrange(0, len(env_hashes), chunk_size):
+            chunk = env_hashes[i:i + chunk_size]
+            query = "SELECT env_hash FROM results WHERE env_hash IN (" + ",".join("?" * len(chunk)) + ")"
+            found.update(env_hash for (env_hash,) in self.connection.execute(query, chunk))
+        return found
+
+    def get(self, env_hashes, chunk_size=500):
+        "dict of env hash -> year2cropResult for the given env hashes with a stored result"
+        env_hashes = list(env_hashes)
+        results = {}
+        for i in xrange(0, len(env_hashes), chunk_size):
+            chunk = env_hashes[i:i + chunk_size]
+            query = "SELECT env_hash, year2crop_result FROM results WHERE env_hash IN (" + ",".join("?" * len(chunk)) + ")"
+            for env_hash, year2crop_result in self.connection.execute(query, chunk):
+                results[env_hash] = json.loads(year2crop_result)
+        return results
+
+    def put(self, env_hash_to_result):
+        "store (env hash, year2cropResult) pairs in one transaction"
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results (env_hash, year2crop_result) VALUES (?, ?)",
+                ((env_hash, json.dumps(result)) for env_hash, result in env_hash_to_result))
+
+    def register_run(self, run_id, ndatacells, cached_cells):
+        "record the total number of datacells of a run and the (row, col, env hash) cells served from the store"
+        with self.connection:
+            self.connection.execute("DELETE FROM run_cached_cells WHERE run_id = ?", (run_id,))
+            self.connection.execute("INSERT OR REPLACE INTO runs (run_id, ndatacells) VALUES (?, ?)", (run_id, ndatacells))
+            self.connection.executemany(
+                "INSERT INTO run_cached_cells (run_id, row, col, env_hash) VALUES (?, ?, ?, ?)",
+                ((run_id, row, col, env_hash) for row, col, env_hash in cached_cells))
+
+    def run_info(self, run_id):
+        "(ndatacells, list of cached (row, col, env hash) cells) of a registered run or (None, []) if unknown"
+        found = self.connection.execute("SELECT ndatacells FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if not found:
+            return None, []
+        cells = self.connection.execute("SELECT row, col, env_hash FROM run_cached_cells WHERE run_id = ?", (run_id,)).fetchall()
+        return found[0], cells